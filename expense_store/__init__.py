@@ -0,0 +1,47 @@
+"""Data access for the expense tracker.
+
+The package has no Streamlit dependency, so scripts, jobs and tests can use
+it directly. Heavy libraries (Pillow, xlsxwriter, openpyxl, fpdf, pyarrow, pandas, pytz) are imported
+inside the functions that need them rather than with the package. Call
+create_tables() once before the first query.
+"""
+
+from .db import get_connection, create_tables, pool_stats
+from .cache import cache_stats
+from .writer import WRITE_TIMEOUT_SECONDS, submit_write, writer_stats
+from .profiling import query_profile, slow_queries, reset_query_profile
+from .users import (
+    USERS_PAGE_SIZE,
+    get_users,
+    get_users_page,
+    authenticate_user,
+    user_exists,
+    register_user,
+    delete_user,
+    delete_users,
+    set_users_active,
+)
+from .expenses import (
+    EXPENSE_COLUMNS,
+    EXPENSE_SUMMARY_COLUMNS,
+    SEARCH_PAGE_SIZE,
+    get_expense,
+    get_expenses,
+    get_recent_expenses,
+    get_expenses_by_date_range,
+    get_expenses_by_purpose_and_date_range,
+    search_expenses,
+    insert_expense,
+    update_expense,
+    delete_expense,
+)
+from .frame import FRAME_PAGE_SIZE, get_expense_frame, frame_page, frame_row
+from .dates import day_number, day_date
+from .bills import get_bill, get_thumbnail, THUMBNAIL_SMALL, THUMBNAIL_PREVIEW
+from .dashboard import get_expense_summary, get_totals_by_purpose, get_monthly_totals
+from .archive import archive_expenses, archive_partitions, archived_years
+from .analytics import analytics_engine
+from .reports import REPORT_FORMATS, download_expense_report_as_excel, download_expense_report_as_csv
+from .snapshot import export_snapshot
+from .jobs import submit_report, get_report_job, cancel_report_job, report_queue_stats
+from .importer import PURPOSES, IMPORT_CHUNK_SIZE, ExpenseImportError, import_expenses
@@ -0,0 +1,113 @@
+# Optional DuckDB engine for the report queries. With
+# EXPENSE_ANALYTICS_ENGINE=duckdb, reports over every user's expenses are
+# answered by DuckDB reading database.db and the archive files through its
+# SQLite scanner: one vectorized, parallel scan and sort instead of SQLite
+# stepping through the purchase_day index a row at a time. Writes and every
+# other read stay on SQLite, and so do per-user reports, which SQLite answers
+# from the username indexes without reading other users' rows. If duckdb is
+# not installed or its sqlite extension can't be loaded, the reports run on
+# SQLite as before.
+
+import logging
+import os
+import threading
+
+from .db import DB_PATH, get_connection
+from .archive import ARCHIVE_COLUMNS, ARCHIVE_DIR, partitions_between
+
+# Set EXPENSE_ANALYTICS_ENGINE=duckdb to answer reports with DuckDB
+ANALYTICS_ENGINE = os.environ.get("EXPENSE_ANALYTICS_ENGINE", "sqlite").lower()
+
+# Columns read from the hot table and the archives. The scanner converts the
+# date columns to DuckDB's TIMESTAMP and DATE types from their declared types;
+# they are cast back to the text SQLite returns, so a report comes out the
+# same on either engine.
+SCAN_COLUMNS = ", ".join(f"CAST({column} AS VARCHAR) AS {column}" if column in ("date", "purchase_date") else column
+                         for column in ARCHIVE_COLUMNS.split(", "))
+
+logger = logging.getLogger("expense_store.analytics")
+
+_database = None
+_unavailable = False
+_lock = threading.Lock()
+
+
+# Function to quote a path as a SQL string; ATTACH takes no parameters
+def _literal(text):
+    return "'" + text.replace("'", "''") + "'"
+
+
+# Function to open the process's DuckDB database with the main file attached
+# read-only, the first time it is needed. Returns None when the engine is off
+# or can't be used; that is logged once and SQLite is used from then on.
+def _open():
+    global _database, _unavailable
+    if ANALYTICS_ENGINE != "duckdb" or _unavailable:
+        return None
+    with _lock:
+        if _database is None and not _unavailable:
+            try:
+                import duckdb
+            except ImportError:
+                _unavailable = True
+                logger.warning("EXPENSE_ANALYTICS_ENGINE is duckdb but duckdb is not installed; reports use SQLite")
+                return None
+            try:
+                database = duckdb.connect()
+                database.execute("INSTALL sqlite")
+                database.execute("LOAD sqlite")
+                database.execute(f"ATTACH {_literal(os.path.abspath(DB_PATH))} AS store (TYPE sqlite, READ_ONLY)")
+            except duckdb.Error as error:
+                _unavailable = True
+                logger.warning("DuckDB could not open the database, reports use SQLite: %s", error)
+                return None
+            _database = database
+    return _database
+
+
+# Function to tell which engine answers the reports
+def analytics_engine():
+    return "duckdb" if _open() is not None else "sqlite"
+
+
+# Function to yield a DuckDB cursor and close it once the rows are read, like
+# the cursors of archive.select_expenses
+def _closing(cursor):
+    try:
+        yield cursor
+    finally:
+        cursor.close()
+
+
+# Function to run a report query on DuckDB over every expense, hot and
+# archived, purchased in a day range, optionally of one purpose. select is
+# the column list and order the ORDER BY, naming the columns of the
+# expenses table. Returns an iterator over a single cursor, as
+# select_expenses does, or None if DuckDB is not in use or the query fails.
+def select_report(select, start_day, end_day, purpose=None, order=""):
+    database = _open()
+    if database is None:
+        return None
+    import duckdb
+
+    partitions = partitions_between(get_connection(), start_day, end_day)
+    cursor = database.cursor()
+    try:
+        tables = ["store.expenses"]
+        for year, file in partitions:
+            schema = f"archive_{int(year)}"
+            with _lock:
+                cursor.execute(f"ATTACH IF NOT EXISTS {_literal(os.path.join(ARCHIVE_DIR, file))} AS {schema} (TYPE sqlite, READ_ONLY)")
+            tables.append(f"{schema}.expenses")
+        scans = " UNION ALL ".join(f"SELECT {SCAN_COLUMNS} FROM {table}" for table in tables)
+
+        conditions, params = ["purchase_day BETWEEN ? AND ?"], [start_day, end_day]
+        if purpose is not None:
+            conditions.append("purpose = ?")
+            params.append(purpose)
+        cursor.execute(f"SELECT {select} FROM ({scans}) AS expenses WHERE {' AND '.join(conditions)} {order}", params)
+    except duckdb.Error as error:
+        cursor.close()
+        logger.warning("DuckDB report query failed, using SQLite: %s", error)
+        return None
+    return _closing(cursor)
@@ -0,0 +1,277 @@
+# Old years of expenses live in per-year archive files, archive/expenses_YYYY.db
+# beside the main database, so the hot file only holds recent years and stays
+# small for inserts and the recent-expense queries. The archive_partitions
+# table (migration 13 in db.py) lists the archived years.
+#
+# Reads over a date range name the table as {expenses} in a SQL branch; the
+# branch runs against the hot table and every archive file overlapping the
+# range, attached to the connection, and the results are combined with
+# UNION ALL. A row is in exactly one file: archiving moves it and archived
+# years are read-only, so the union needs no de-duplication. Rows written
+# later into an archived year stay in the hot file until the year is archived
+# again. The one write to an archived year is deleting a user, which removes
+# their rows from every archive file (see purge_archived_users).
+
+import json
+import os
+import sqlite3
+from datetime import date
+
+from .db import DB_PATH, get_connection
+from .cache import cached_read, invalidates
+from .dates import day_number, day_date
+from .rollups import ROLLUP_DAY
+from .frame import prune_tombstones
+from .snapshot import SNAPSHOT_MONTH
+
+# Directory of the archive files
+ARCHIVE_DIR = os.environ.get("EXPENSE_ARCHIVE_DIR", os.path.join(os.path.dirname(os.path.abspath(DB_PATH)), "archive"))
+
+# Columns kept for archived expenses; bill images stay in the hot bills table
+ARCHIVE_COLUMNS = "id, date, date_ts, amount, purpose, description, purchase_date, purchase_day, bill_hash, company_name, contact_details, username"
+
+# Schema of the expenses table in an archive file, with the indexes the date
+# range and per-user queries use
+ARCHIVE_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS {schema}.expenses (
+        id INTEGER PRIMARY KEY,
+        date TIMESTAMP,
+        date_ts INTEGER,
+        amount REAL NOT NULL,
+        purpose TEXT NOT NULL,
+        description TEXT,
+        purchase_date DATE,
+        purchase_day INTEGER,
+        bill_hash TEXT,
+        company_name TEXT,
+        contact_details TEXT,
+        username TEXT NOT NULL
+    )
+    ''',
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_expenses_purchase_day ON expenses (purchase_day)",
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_expenses_purpose_purchase_day ON expenses (purpose, purchase_day)",
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_expenses_username_purchase_day ON expenses (username, purchase_day)",
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_expenses_username_purpose_purchase_day ON expenses (username, purpose, purchase_day)",
+]
+
+
+# Function to get the schema name an archive year is attached under
+def _schema(year):
+    return f"archive_{int(year)}"
+
+
+# Function to get the first and last day number of a year
+def _year_days(year):
+    return day_number(date(year, 1, 1)), day_number(date(year, 12, 31))
+
+
+# Function to attach the archive files of the given (year, file) partitions
+# to the connection, detaching other archives first if they would not all
+# fit. ATTACH and DETACH can't run inside a transaction, so this is only
+# called between statements.
+def _attach(conn, partitions):
+    wanted = {_schema(year): file for year, file in partitions}
+    attached = {row[1] for row in conn.execute("PRAGMA database_list") if row[1].startswith("archive_")}
+    if len(attached | set(wanted)) > conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED):
+        for schema in attached - set(wanted):
+            conn.execute(f"DETACH DATABASE {schema}")
+            attached.discard(schema)
+    for schema, file in wanted.items():
+        if schema not in attached:
+            conn.execute(f"ATTACH DATABASE ? AS {schema}", (os.path.join(ARCHIVE_DIR, file),))
+
+
+# Function to list the archived years overlapping a day range as (year, file),
+# in year order. None for either bound leaves that side of the range open.
+def partitions_between(conn, start_day, end_day):
+    first_year = day_date(start_day).year if start_day is not None else 0
+    last_year = day_date(end_day).year if end_day is not None else 9999
+    return conn.execute("SELECT year, file FROM archive_partitions WHERE year BETWEEN ? AND ? ORDER BY year",
+                        (first_year, last_year)).fetchall()
+
+
+# Function to split a day range into windows whose archive files can all be
+# attached at once, attaching each window's files when it is reached. Yields
+# (table names, first day, last day) in day order; the hot table is in every
+# window. None for either bound leaves that side of the range open.
+def _windows(conn, start_day, end_day):
+    partitions = partitions_between(conn, start_day, end_day)
+    if not partitions:
+        yield ["expenses"], start_day, end_day
+        return
+
+    size = conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+    first_day = start_day
+    for index in range(0, len(partitions), size):
+        group = partitions[index:index + size]
+        _attach(conn, group)
+        tables = ["expenses"] + [f"{_schema(year)}.expenses" for year, _ in group]
+        if index + size >= len(partitions):
+            yield tables, first_day, end_day
+        else:
+            last_day = _year_days(group[-1][0])[1]
+            yield tables, first_day, last_day
+            first_day = last_day + 1
+
+
+# Function to run a SQL branch over the hot expenses table and the archives
+# overlapping the day range. branch is a SELECT naming its table {expenses};
+# params(first_day, last_day) returns its parameters for a window of the
+# range, and tail (for example an ORDER BY over the result columns) with
+# tail_params is applied to the combined rows. Yields one cursor per window,
+# in day order; a window's cursor is closed once the next is asked for.
+def select_expenses(conn, branch, start_day, end_day, params, tail="", tail_params=()):
+    for tables, first_day, last_day in _windows(conn, start_day, end_day):
+        sql = " UNION ALL ".join(branch.format(expenses=table) for table in tables)
+        cursor = conn.execute(f"{sql} {tail}", tuple(params(first_day, last_day)) * len(tables) + tuple(tail_params))
+        try:
+            yield cursor
+        finally:
+            cursor.close()
+
+
+# Function to move one year of expenses from the hot file into its archive
+# file. Returns the number of rows moved.
+def archive_year(conn, year):
+    schema = _schema(year)
+    file = f"expenses_{year}.db"
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    _attach(conn, [(year, file)])
+    first_day, last_day = _year_days(year)
+
+    # One write transaction over both files, which holds off other writers
+    # while the rows are copied and deleted. SQLite in WAL mode commits each
+    # file on its own, so a crash during the commit can leave rows in both;
+    # archiving the year again settles them.
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        for statement in ARCHIVE_SCHEMA:
+            conn.execute(statement.format(schema=schema))
+        moved = conn.execute(f'''
+            INSERT OR REPLACE INTO {schema}.expenses ({ARCHIVE_COLUMNS})
+            SELECT {ARCHIVE_COLUMNS} FROM main.expenses WHERE purchase_day BETWEEN ? AND ?
+        ''', (first_day, last_day)).rowcount
+
+        # The delete triggers take the rows out of the rollups and user totals;
+        # their totals are put back, and kept in archive_rollups, so the
+        # dashboard and Manage Users still count archived expenses
+        conn.execute("DROP TABLE IF EXISTS temp.moved_rollups")
+        conn.execute(f'''
+            CREATE TEMP TABLE moved_rollups AS
+            SELECT username, purpose, {ROLLUP_DAY} AS day, SUM(amount) AS total, COUNT(*) AS count
+            FROM main.expenses WHERE purchase_day BETWEEN ? AND ?
+            GROUP BY username, purpose, day
+        ''', (first_day, last_day))
+        conn.execute('''
+            INSERT OR IGNORE INTO main.archived_bills (hash)
+            SELECT DISTINCT bill_hash FROM main.expenses
+            WHERE purchase_day BETWEEN ? AND ? AND bill_hash IS NOT NULL
+        ''', (first_day, last_day))
+        conn.execute("DELETE FROM main.expenses WHERE purchase_day BETWEEN ? AND ?", (first_day, last_day))
+
+        for table in ("main.expense_rollups", "main.archive_rollups"):
+            conn.execute(f'''
+                INSERT INTO {table} (username, purpose, day, total, count)
+                SELECT username, purpose, day, total, count FROM temp.moved_rollups WHERE true
+                ON CONFLICT (username, purpose, day) DO UPDATE
+                SET total = total + excluded.total, count = count + excluded.count
+            ''')
+        conn.execute('''
+            UPDATE main.users SET total_expense = total_expense + moved.total
+            FROM (SELECT username, SUM(total) AS total FROM temp.moved_rollups GROUP BY username) AS moved
+            WHERE users.username = moved.username
+        ''')
+        conn.execute("DROP TABLE temp.moved_rollups")
+
+        conn.execute('''
+            INSERT INTO main.archive_partitions (year, file, rows) VALUES (?, ?, ?)
+            ON CONFLICT (year) DO UPDATE SET file = excluded.file, rows = rows + excluded.rows
+        ''', (year, file, moved))
+    return moved
+
+
+# Function to archive every year of expenses purchased before the given year,
+# then prune the tombstones that leaves behind. Returns {year: rows moved}.
+@invalidates
+def archive_expenses(conn, before_year):
+    years = [row[0] for row in conn.execute('''
+        SELECT DISTINCT CAST(strftime('%Y', purchase_day * 86400, 'unixepoch') AS INTEGER)
+        FROM expenses WHERE purchase_day < ?
+    ''', (day_number(date(before_year, 1, 1)),))]
+    moved = {year: archive_year(conn, year) for year in sorted(years)}
+    # Every archived row left a tombstone for the in-memory frames
+    prune_tombstones(conn)
+    return moved
+
+
+# Function to list the archived years as (year, file, rows)
+def archive_partitions(conn):
+    return conn.execute("SELECT year, file, rows FROM archive_partitions ORDER BY year").fetchall()
+
+
+# Function to list the archived years, for pages that say which years a
+# feature doesn't cover
+@cached_read
+def archived_years():
+    return [year for year, _, _ in archive_partitions(get_connection())]
+
+
+# Function to run func(conn, years) on groups of archived years whose files
+# are attached together, every group in its own write transaction
+def _each_attached_group(conn, func):
+    partitions = conn.execute("SELECT year, file FROM archive_partitions ORDER BY year").fetchall()
+    size = conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+    for index in range(0, len(partitions), size):
+        group = partitions[index:index + size]
+        _attach(conn, group)
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            func(conn, [year for year, _ in group])
+
+
+# Function to delete the archived expenses of users who are being deleted.
+# ATTACH can't run inside a transaction and only so many files can be
+# attached at once, so each group of archive files is purged in its own
+# transaction, before the caller's transaction removes the users; if that
+# fails, deleting the users again finishes the job. The snapshot versions of
+# the months losing rows are bumped. The rollups and bill
+# references of the archived rows are left to the caller. Returns the number
+# of rows deleted and the bill hashes no archived expense refers to any more.
+def purge_archived_users(conn, usernames):
+    names = json.dumps(list(usernames))
+    deleted = [0]
+    digests = set()
+
+    def purge(conn, years):
+        for year in years:
+            schema = _schema(year)
+            digests.update(row[0] for row in conn.execute(f'''
+                SELECT DISTINCT bill_hash FROM {schema}.expenses
+                WHERE username IN (SELECT value FROM json_each(?)) AND bill_hash IS NOT NULL
+            ''', (names,)))
+            # The archive files have no snapshot triggers, so the months
+            # losing rows are bumped here
+            conn.execute(f'''
+                INSERT INTO main.snapshot_versions (month, version)
+                SELECT DISTINCT {SNAPSHOT_MONTH}, 1 FROM {schema}.expenses
+                WHERE username IN (SELECT value FROM json_each(?))
+                ON CONFLICT (month) DO UPDATE SET version = version + 1
+            ''', (names,))
+            count = conn.execute(f"DELETE FROM {schema}.expenses WHERE username IN (SELECT value FROM json_each(?))",
+                                 (names,)).rowcount
+            conn.execute("UPDATE main.archive_partitions SET rows = rows - ? WHERE year = ?", (count, year))
+            deleted[0] += count
+
+    # Bills still used by another user's archived expense, in any year
+    def keep_used(conn, years):
+        for year in years:
+            digests.difference_update(row[0] for row in conn.execute(f'''
+                SELECT DISTINCT bill_hash FROM {_schema(year)}.expenses
+                WHERE bill_hash IN (SELECT value FROM json_each(?))
+            ''', (json.dumps(sorted(digests)),)))
+
+    _each_attached_group(conn, purge)
+    if digests:
+        _each_attached_group(conn, keep_used)
+    return deleted[0], sorted(digests)
@@ -0,0 +1,308 @@
+import hashlib
+import json
+import os
+from collections import namedtuple
+from io import BytesIO
+
+from .db import get_connection
+from .cache import cached_read
+
+# Longest side, in pixels, of the thumbnails stored for every image bill:
+# a small one for lists and a larger preview for the opened expense
+THUMBNAIL_SMALL = 128
+THUMBNAIL_PREVIEW = 512
+THUMBNAIL_SIZES = (THUMBNAIL_SMALL, THUMBNAIL_PREVIEW)
+
+THUMBNAIL_QUALITY = 80
+
+# Uploaded images are downscaled to this longest side, in pixels, and
+# re-encoded without their metadata as JPEG or WEBP at this quality. PDFs and
+# files Pillow can't read are stored as uploaded.
+BILL_MAX_SIDE = int(os.environ.get("EXPENSE_BILL_MAX_SIDE", "2000"))
+BILL_FORMAT = os.environ.get("EXPENSE_BILL_FORMAT", "JPEG").upper()
+BILL_QUALITY = int(os.environ.get("EXPENSE_BILL_QUALITY", "80"))
+
+# An upload ready to be stored: the hash of the uploaded bytes, the bytes to
+# store and their codec, and the thumbnails. data is None for a bill that is
+# already stored.
+PreparedBill = namedtuple("PreparedBill", "digest data original_size codec thumbnails")
+
+# Codec recorded for bills kept exactly as uploaded
+RAW_CODEC = "raw"
+PDF_MAGIC = b"%PDF"
+
+# EXIF tag holding the orientation an image is to be shown in
+ORIENTATION_TAG = 0x0112
+
+
+# Function to compute the content address of an uploaded bill
+def bill_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+# Function to render the thumbnails of a bill as {size: JPEG bytes}. Bills
+# that are not images (PDFs) have no thumbnails.
+def make_thumbnails(data):
+    # Pillow is only needed when a bill is stored, so it is not imported with
+    # the package
+    from PIL import Image
+
+    try:
+        image = Image.open(BytesIO(data))
+        image.load()
+    except (OSError, Image.DecompressionBombError):
+        return {}
+
+    image = image.convert("RGB")
+    thumbnails = {}
+    for size in THUMBNAIL_SIZES:
+        thumbnail = image.copy()
+        thumbnail.thumbnail((size, size))
+        output = BytesIO()
+        thumbnail.save(output, "JPEG", quality=THUMBNAIL_QUALITY, optimize=True)
+        thumbnails[size] = output.getvalue()
+    return thumbnails
+
+
+# Function to store the thumbnails of a bill; returns how many were stored
+def put_thumbnails(conn, digest, data):
+    thumbnails = make_thumbnails(data)
+    conn.executemany("INSERT OR REPLACE INTO bill_thumbnails (hash, size, data) VALUES (?, ?, ?)",
+                     [(digest, size, thumbnail) for size, thumbnail in thumbnails.items()])
+    return len(thumbnails)
+
+
+# JPEG markers of the segments dropped as metadata: APP1 to APP13 and APP15
+# (EXIF, XMP, ICC profiles, IPTC) and comments. APP0 (JFIF) and APP14 (Adobe)
+# stay, decoders need them for the colour transform.
+JPEG_METADATA_MARKERS = set(range(0xE1, 0xEE)) | {0xEF, 0xFE}
+
+
+# Function to copy a JPEG without its metadata segments and anything after
+# the end of the image, leaving the compressed image data as it is. Returns
+# None if the file can't be parsed.
+def _strip_jpeg(data):
+    if not data.startswith(b"\xff\xd8"):
+        return None
+    kept = [data[:2]]
+    pos = 2
+    while pos + 2 <= len(data):
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            # Fill byte before a marker
+            pos += 1
+            continue
+        if marker == 0xD9:
+            kept.append(data[pos:pos + 2])
+            return b"".join(kept)
+        end = pos + 2 + int.from_bytes(data[pos + 2:pos + 4], "big")
+        if end > len(data):
+            return None
+        if marker not in JPEG_METADATA_MARKERS:
+            kept.append(data[pos:end])
+        pos = end
+        if marker == 0xDA:
+            # The scan's image data runs to the next marker that is not a
+            # stuffed 0xFF or a restart marker
+            while True:
+                pos = data.find(b"\xff", pos)
+                if pos < 0 or pos + 1 >= len(data):
+                    return None
+                if data[pos + 1] != 0 and not 0xD0 <= data[pos + 1] <= 0xD7:
+                    break
+                pos += 2
+            kept.append(data[end:pos])
+    return None
+
+
+# Function to copy an uploaded image without its metadata in its own format:
+# JPEGs losslessly (see _strip_jpeg) and PNGs saved again by Pillow, which
+# only writes the chunks it is handed. Returns None for other formats.
+def _strip_metadata(data, image_format):
+    if image_format == "JPEG":
+        return _strip_jpeg(data)
+    if image_format == "PNG":
+        from PIL import Image
+
+        output = BytesIO()
+        Image.open(BytesIO(data)).save(output, "PNG", optimize=True, icc_profile=None)
+        return output.getvalue()
+    return None
+
+
+# Function to compress an uploaded bill for storage. Returns the bytes to
+# store and their codec: the configured image format for images, "pdf" for
+# PDFs and "raw" for files Pillow can't read. When re-encoding doesn't make an
+# image smaller, the upload is kept in its own format with its metadata
+# removed, if that is smaller still.
+def compress_bill(data):
+    if data.startswith(PDF_MAGIC):
+        return data, "pdf"
+
+    from PIL import Image, ImageOps
+
+    try:
+        image = Image.open(BytesIO(data))
+        # JPEGs can be decoded straight at a reduced scale, which is much
+        # faster than decoding the full photo and shrinking it afterwards
+        image.draft("RGB", (BILL_MAX_SIDE, BILL_MAX_SIDE))
+        image.load()
+    except (OSError, Image.DecompressionBombError):
+        return data, RAW_CODEC
+
+    # Apply the EXIF rotation before the metadata is dropped
+    source_format = image.format
+    rotated = image.getexif().get(ORIENTATION_TAG, 1) != 1
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+        # Transparent areas become white instead of black
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, "white")
+        background.paste(image, mask=image.getchannel("A"))
+        image = background
+    else:
+        image = image.convert("RGB")
+    image.thumbnail((BILL_MAX_SIDE, BILL_MAX_SIDE))
+
+    # Saving without exif or icc_profile leaves the metadata behind
+    output = BytesIO()
+    image.save(output, BILL_FORMAT, quality=BILL_QUALITY, optimize=True)
+    compressed = output.getvalue()
+    if len(compressed) >= len(data) and not rotated:
+        # Without the EXIF orientation a rotated upload would show sideways
+        stripped = _strip_metadata(data, source_format)
+        if stripped is not None and len(stripped) < len(compressed):
+            return stripped, source_format.lower()
+    return compressed, BILL_FORMAT.lower()
+
+
+# Function to do the slow part of storing an uploaded bill - hashing,
+# compression and thumbnails - before the write it belongs to is queued, so
+# none of it happens inside a write transaction. The hash is that of the
+# uploaded bytes, so a bill that is already stored is recognised before it is
+# compressed. Returns a PreparedBill for put_bill, or None without a bill.
+def prepare_bill(data):
+    if not data:
+        return None
+    digest = bill_hash(data)
+    conn = get_connection()
+    if conn.execute("SELECT 1 FROM bills WHERE hash = ?", (digest,)).fetchone():
+        return PreparedBill(digest, None, len(data), None, None)
+    stored, codec = compress_bill(data)
+    return PreparedBill(digest, stored, len(data), codec, make_thumbnails(stored))
+
+
+# Function to store a prepared bill once and return its hash. Runs on the
+# writer's connection so it joins the write's transaction.
+def put_bill(conn, bill):
+    if bill is None:
+        return None
+    if bill.data is None:
+        # Prepared as already stored; it may have been released since
+        if not conn.execute("SELECT 1 FROM bills WHERE hash = ?", (bill.digest,)).fetchone():
+            raise ValueError("The bill was removed while the expense was being saved, please upload it again")
+        return bill.digest
+    cursor = conn.execute("INSERT OR IGNORE INTO bills (hash, data, size, original_size, codec) VALUES (?, ?, ?, ?, ?)",
+                          (bill.digest, bill.data, len(bill.data), bill.original_size, bill.codec))
+    if cursor.rowcount:
+        conn.executemany("INSERT OR REPLACE INTO bill_thumbnails (hash, size, data) VALUES (?, ?, ?)",
+                         [(bill.digest, size, thumbnail) for size, thumbnail in bill.thumbnails.items()])
+    return bill.digest
+
+
+# Function to load the bytes of a stored bill
+def get_bill(digest):
+    if not digest:
+        return None
+    conn = get_connection()
+    row = conn.execute("SELECT data FROM bills WHERE hash = ?", (digest,)).fetchone()
+    return row[0] if row else None
+
+
+# Function to load a bill's thumbnail of the given size, or None if the bill
+# has no thumbnails
+@cached_read
+def get_thumbnail(digest, size=THUMBNAIL_SMALL):
+    if not digest:
+        return None
+    conn = get_connection()
+    row = conn.execute("SELECT data FROM bill_thumbnails WHERE hash = ? AND size = ?", (digest, size)).fetchone()
+    return row[0] if row else None
+
+
+# Function to drop a bill once no expense refers to it any more
+def release_bill(conn, digest):
+    if not digest:
+        return
+    release_bills(conn, [digest])
+
+
+# Function to drop the given bills that no expense refers to any more, in one
+# statement however many there are. Returns the number of bills removed.
+def release_bills(conn, digests):
+    digests = json.dumps(list(digests))
+    cursor = conn.execute('''
+        DELETE FROM bills
+        WHERE hash IN (SELECT value FROM json_each(?))
+        AND NOT EXISTS (SELECT 1 FROM expenses WHERE expenses.bill_hash = bills.hash)
+        AND NOT EXISTS (SELECT 1 FROM archived_bills WHERE archived_bills.hash = bills.hash)
+    ''', (digests,))
+    conn.execute('''
+        DELETE FROM bill_thumbnails
+        WHERE hash IN (SELECT value FROM json_each(?))
+        AND NOT EXISTS (SELECT 1 FROM bills WHERE bills.hash = bill_thumbnails.hash)
+    ''', (digests,))
+    return cursor.rowcount
+
+
+# Function to remove every bill that no expense, hot or archived, refers to
+def prune_bills(conn):
+    cursor = conn.execute('''
+        DELETE FROM bills
+        WHERE NOT EXISTS (SELECT 1 FROM expenses WHERE expenses.bill_hash = bills.hash)
+        AND NOT EXISTS (SELECT 1 FROM archived_bills WHERE archived_bills.hash = bills.hash)
+    ''')
+    conn.execute('''
+        DELETE FROM bill_thumbnails
+        WHERE NOT EXISTS (SELECT 1 FROM bills WHERE bills.hash = bill_thumbnails.hash)
+    ''')
+    return cursor.rowcount
+
+
+# Function to generate thumbnails for stored image bills that have none.
+# Bills are loaded one at a time; PDFs are skipped. Returns the number of
+# bills given thumbnails.
+def backfill_thumbnails(conn):
+    digests = [row[0] for row in conn.execute('''
+        SELECT hash FROM bills
+        WHERE substr(data, 1, 4) != X'25504446'
+        AND NOT EXISTS (SELECT 1 FROM bill_thumbnails WHERE bill_thumbnails.hash = bills.hash)
+    ''')]
+
+    filled = 0
+    for digest in digests:
+        with conn:
+            data = conn.execute("SELECT data FROM bills WHERE hash = ?", (digest,)).fetchone()[0]
+            if put_thumbnails(conn, digest, data):
+                filled += 1
+    return filled
+
+
+# Function to compress the bills stored before uploads were compressed, one
+# bill per transaction. Their hashes, and so the expenses pointing at them,
+# stay the same. Returns the number of bills processed and their total size
+# before and after.
+def recompress_bills(conn):
+    digests = [row[0] for row in conn.execute("SELECT hash FROM bills WHERE codec IS NULL")]
+
+    size_before = size_after = 0
+    for digest in digests:
+        with conn:
+            data = conn.execute("SELECT data FROM bills WHERE hash = ?", (digest,)).fetchone()[0]
+            stored, codec = compress_bill(data)
+            conn.execute("UPDATE bills SET data = ?, size = ?, codec = ? WHERE hash = ?", (stored, len(stored), codec, digest))
+        size_before += len(data)
+        size_after += len(stored)
+    return len(digests), size_before, size_after
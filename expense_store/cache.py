@@ -0,0 +1,127 @@
+import functools
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from .db import DB_PATH
+
+# Size and age limits of the process-wide read cache
+CACHE_MAX_ENTRIES = 256
+CACHE_TTL_SECONDS = 300
+
+
+class ReadCache:
+    """LRU cache of query results with a time-to-live per entry.
+
+    Keys include the data version, which every write of this process bumps,
+    and SQLite's data_version as seen by a connection of the cache's own,
+    which changes whenever any other connection or process commits, so
+    results cached before a write are never served after it, wherever the
+    write came from; they simply age out.
+    """
+
+    def __init__(self, max_entries, ttl, path):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.version = 0
+        self._conn = None
+        self._conn_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stored_version(self):
+        # The connection never writes, so every commit changes the value
+        with self._conn_lock:
+            if self._conn is None:
+                self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def bump_version(self):
+        with self._lock:
+            self.version += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "version": self.version,
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+_cache = ReadCache(CACHE_MAX_ENTRIES, CACHE_TTL_SECONDS, DB_PATH)
+
+
+# Decorator that caches a read function by its arguments and the current data
+# version. Callers must not mutate the returned value.
+def cached_read(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        key = (func.__module__, func.__qualname__, args, tuple(sorted(kwargs.items())), data_version())
+        try:
+            found, value = _cache.get(key)
+        except TypeError:
+            # Unhashable arguments are never cached
+            return func(*args, **kwargs)
+        if not found:
+            value = func(*args, **kwargs)
+            _cache.put(key, value)
+        return value
+    return wrapper
+
+
+# Decorator for functions that change data; bumps the data version once the
+# write has run, whether or not it succeeded
+def invalidates(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _cache.bump_version()
+    return wrapper
+
+
+# Function to invalidate every cached read, e.g. after a bulk change
+def bump_data_version():
+    _cache.bump_version()
+
+
+# Function to get the current data version, covering writes from this
+# process and from others, for caches kept outside the read cache
+def data_version():
+    return _cache.version, _cache.stored_version()
+
+
+# Function to report cache hit/miss counters
+def cache_stats():
+    return _cache.stats()
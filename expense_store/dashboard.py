@@ -0,0 +1,70 @@
+from datetime import date
+
+from .db import get_connection
+from .cache import cached_read
+
+# All aggregates read the expense_rollups table, which holds one row per
+# (username, purpose, day) instead of one per expense. With a username they
+# read only that user's rollups through the table's primary key; None
+# aggregates every user.
+
+
+# Function to get the total, count and average of all expenses in one query
+@cached_read
+def get_expense_summary(username=None):
+    conn = get_connection()
+    if username is None:
+        cursor = conn.execute("SELECT IFNULL(SUM(total), 0), IFNULL(SUM(count), 0) FROM expense_rollups")
+    else:
+        cursor = conn.execute("SELECT IFNULL(SUM(total), 0), IFNULL(SUM(count), 0) FROM expense_rollups WHERE username = ?",
+                              (username,))
+    total, count = cursor.fetchone()
+    average = total / count if count > 0 else 0
+    return total, count, average
+
+
+# Function to get the total amount spent per purpose
+@cached_read
+def get_totals_by_purpose(username=None):
+    conn = get_connection()
+    if username is None:
+        cursor = conn.execute('''
+            SELECT purpose, SUM(total)
+            FROM expense_rollups
+            GROUP BY purpose
+            ORDER BY purpose
+        ''')
+    else:
+        cursor = conn.execute('''
+            SELECT purpose, SUM(total)
+            FROM expense_rollups
+            WHERE username = ?
+            GROUP BY purpose
+            ORDER BY purpose
+        ''', (username,))
+    return cursor.fetchall()
+
+
+# Function to get the total amount recorded per month, keyed by the date of
+# the first day of the month so the result can be plotted on a date axis
+# without parsing
+@cached_read
+def get_monthly_totals(username=None):
+    conn = get_connection()
+    if username is None:
+        cursor = conn.execute('''
+            SELECT substr(day, 1, 7) || '-01' AS month, SUM(total)
+            FROM expense_rollups
+            WHERE day != ''
+            GROUP BY month
+            ORDER BY month
+        ''')
+    else:
+        cursor = conn.execute('''
+            SELECT substr(day, 1, 7) || '-01' AS month, SUM(total)
+            FROM expense_rollups
+            WHERE username = ? AND day != ''
+            GROUP BY month
+            ORDER BY month
+        ''', (username,))
+    return [(date.fromisoformat(month), total) for month, total in cursor]
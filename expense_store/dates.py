@@ -0,0 +1,45 @@
+# Expense dates are stored twice: the original text, for display, and an
+# integer that every filter, sort and index uses. date_ts is the recorded time
+# in epoch seconds; purchase_day is the purchase date as days since 1970-01-01.
+# Triggers created by migration 9 in db.py fill in the integers for writers
+# that only set the text.
+
+from calendar import timegm
+from datetime import date, datetime, timedelta
+
+# Recorded times are written in India Standard Time, UTC+05:30
+IST_OFFSET_SECONDS = 19800
+
+EPOCH_DAY = date(1970, 1, 1)
+
+# SQL computing the integer columns from the text ones; NULL if unparsable
+DATE_TS_SQL = f"CAST(strftime('%s', date) AS INTEGER) - {IST_OFFSET_SECONDS}"
+PURCHASE_DAY_SQL = "CAST(julianday(substr(purchase_date, 1, 10)) - 2440587.5 AS INTEGER)"
+
+
+# Function to convert a date, datetime or ISO date string into a day number,
+# or None if it is empty or not a date
+def day_number(value):
+    if isinstance(value, datetime):
+        value = value.date()
+    elif not isinstance(value, date):
+        try:
+            value = date.fromisoformat(str(value or "").strip()[:10])
+        except ValueError:
+            return None
+    return (value - EPOCH_DAY).days
+
+
+# Function to convert a day number back into a date
+def day_date(day):
+    if day is None:
+        return None
+    return EPOCH_DAY + timedelta(days=day)
+
+
+# Function to convert a recorded time into epoch seconds; times without a
+# timezone are taken to be in India Standard Time, like the stored text
+def epoch_seconds(moment):
+    if moment.tzinfo is None:
+        return timegm(moment.timetuple()) - IST_OFFSET_SECONDS
+    return int(moment.timestamp())
@@ -0,0 +1,549 @@
+import os
+import sqlite3
+import hashlib
+import threading
+
+from .rollups import ROLLUP_DAY, rebuild_rollups, reconcile_user_totals
+from .snapshot import SNAPSHOT_MONTH
+from .dates import DATE_TS_SQL, PURCHASE_DAY_SQL
+from .profiling import connection_factory
+
+# Path of the SQLite database shared by every page of the app
+DB_PATH = os.environ.get("EXPENSE_DB_PATH", "database.db")
+
+# PRAGMA profiles for the pooled connections, selected with EXPENSE_DB_PROFILE.
+# cache_size is negative, so it is a size in KiB rather than a page count.
+PROFILES = {
+    "small": {"mmap_size": 0, "cache_size": -2000, "busy_timeout": 5000, "max_idle": 4},
+    "default": {"mmap_size": 64 * 1024 * 1024, "cache_size": -16000, "busy_timeout": 5000, "max_idle": 8},
+    "large": {"mmap_size": 256 * 1024 * 1024, "cache_size": -64000, "busy_timeout": 10000, "max_idle": 16},
+}
+
+
+class ConnectionPool:
+    """Process-wide pool of SQLite connections, one leased per thread.
+
+    Streamlit runs every rerun of every session in a thread of the same
+    process, so connections are leased to the current thread and handed
+    back to the idle list once that thread has finished.
+    """
+
+    def __init__(self, path, profile):
+        self.path = path
+        self.profile = profile
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._leases = {}
+        self._idle = []
+
+    def connection(self):
+        thread = threading.current_thread()
+        with self._lock:
+            conn = self._leases.get(thread)
+            if conn is None:
+                self._reclaim()
+                if self._idle:
+                    conn = self._idle.pop()
+            if conn is not None:
+                self.hits += 1
+                self._leases[thread] = conn
+                return conn
+            self.misses += 1
+
+        conn = self._connect()
+        with self._lock:
+            self._leases[thread] = conn
+        return conn
+
+    def _connect(self):
+        # Connections move between threads once their first thread is done,
+        # but only one thread ever uses a connection at a time
+        conn = sqlite3.connect(self.path, check_same_thread=False, factory=connection_factory())
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={int(self.profile['busy_timeout'])}")
+        conn.execute(f"PRAGMA mmap_size={int(self.profile['mmap_size'])}")
+        conn.execute(f"PRAGMA cache_size={int(self.profile['cache_size'])}")
+        return conn
+
+    def _reclaim(self):
+        # Return the connections of finished threads to the idle list
+        for thread in [t for t in self._leases if not t.is_alive()]:
+            conn = self._leases.pop(thread)
+            if conn.in_transaction:
+                conn.rollback()
+            if len(self._idle) < self.profile["max_idle"]:
+                self._idle.append(conn)
+            else:
+                conn.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "leased": len(self._leases),
+                "idle": len(self._idle),
+            }
+
+    def close_all(self):
+        with self._lock:
+            for conn in list(self._leases.values()) + self._idle:
+                conn.close()
+            self._leases.clear()
+            self._idle.clear()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                profile = PROFILES[os.environ.get("EXPENSE_DB_PROFILE", "default")]
+                _pool = ConnectionPool(DB_PATH, profile)
+    return _pool
+
+
+# Function to get the current thread's connection from the shared pool
+def get_connection():
+    return get_pool().connection()
+
+
+# Function to report pool hit/miss counters
+def pool_stats():
+    return get_pool().stats()
+
+
+# Migration 1: move bill images out of the expenses rows into the
+# content-addressed bills table, keyed by the SHA-256 of the upload
+def _migrate_bills_table(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS bills (
+            hash TEXT PRIMARY KEY,
+            data BLOB NOT NULL,
+            size INTEGER NOT NULL
+        )
+    ''')
+    conn.execute("ALTER TABLE expenses ADD COLUMN bill_hash TEXT REFERENCES bills(hash)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_expenses_bill_hash ON expenses (bill_hash)")
+
+    conn.create_function("sha256", 1, lambda data: hashlib.sha256(data).hexdigest(), deterministic=True)
+    conn.execute('''
+        INSERT OR IGNORE INTO bills (hash, data, size)
+        SELECT sha256(bill_image), bill_image, length(bill_image)
+        FROM expenses WHERE bill_image IS NOT NULL
+    ''')
+    conn.execute("UPDATE expenses SET bill_hash = sha256(bill_image), bill_image = NULL WHERE bill_image IS NOT NULL")
+
+
+# Migration 2: secondary indexes for the date range, per-user and recent
+# expense queries
+def _migrate_expense_indexes(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_expenses_purchase_date_purpose ON expenses (purchase_date, purpose)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_expenses_username_purchase_date ON expenses (username, purchase_date)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_expenses_date ON expenses (date DESC)")
+
+
+# Migration 3: indexes that return search pages already in (purchase_date, id)
+# order; they replace the (purchase_date, purpose) index, whose order needed a
+# sort step for keyset pagination
+def _migrate_search_indexes(conn):
+    conn.execute("DROP INDEX IF EXISTS idx_expenses_purchase_date_purpose")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_expenses_purchase_date ON expenses (purchase_date)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_expenses_purpose_purchase_date ON expenses (purpose, purchase_date)")
+
+
+# Migration 4: per-user, per-purpose, per-day rollups of the expenses table,
+# kept current by triggers so aggregates never have to read the raw rows
+def _migrate_expense_rollups(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS expense_rollups (
+            username TEXT NOT NULL,
+            purpose TEXT NOT NULL,
+            day TEXT NOT NULL,
+            total REAL NOT NULL DEFAULT 0.0,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (username, purpose, day)
+        ) WITHOUT ROWID
+    ''')
+
+    # The rollup day expression, applied to the row before and after the write
+    new_day = ROLLUP_DAY.replace("date", "NEW.date")
+    old_day = ROLLUP_DAY.replace("date", "OLD.date")
+
+    add_new = f'''
+        INSERT INTO expense_rollups (username, purpose, day, total, count)
+        VALUES (NEW.username, NEW.purpose, {new_day}, NEW.amount, 1)
+        ON CONFLICT (username, purpose, day) DO UPDATE SET total = total + excluded.total, count = count + 1;
+    '''
+    remove_old = f'''
+        UPDATE expense_rollups SET total = total - OLD.amount, count = count - 1
+        WHERE username = OLD.username AND purpose = OLD.purpose AND day = {old_day};
+        DELETE FROM expense_rollups
+        WHERE username = OLD.username AND purpose = OLD.purpose AND day = {old_day}
+        AND count <= 0;
+    '''
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS expenses_rollup_insert AFTER INSERT ON expenses BEGIN {add_new} END")
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS expenses_rollup_delete AFTER DELETE ON expenses BEGIN {remove_old} END")
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS expenses_rollup_update
+        AFTER UPDATE OF amount, purpose, username, date ON expenses
+        BEGIN {remove_old} {add_new} END
+    ''')
+
+    # archive_rollups is only created by migration 13
+    rebuild_rollups(conn, archived=False)
+
+
+# Migration 5: keep users.total_expense in step with every expense write, so
+# Manage Users reads each user's total without touching the expenses table
+def _migrate_user_totals(conn):
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS expenses_user_total_insert AFTER INSERT ON expenses
+        BEGIN
+            UPDATE users SET total_expense = total_expense + NEW.amount WHERE username = NEW.username;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS expenses_user_total_delete AFTER DELETE ON expenses
+        BEGIN
+            UPDATE users SET total_expense = total_expense - OLD.amount WHERE username = OLD.username;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS expenses_user_total_update AFTER UPDATE OF amount, username ON expenses
+        BEGIN
+            UPDATE users SET total_expense = total_expense - OLD.amount WHERE username = OLD.username;
+            UPDATE users SET total_expense = total_expense + NEW.amount WHERE username = NEW.username;
+        END
+    ''')
+    conn.execute("UPDATE users SET total_expense = 0.0 WHERE total_expense IS NULL")
+
+    reconcile_user_totals(conn, archived=False)
+
+
+# Migration 6: downscaled JPEG thumbnails of image bills, keyed by bill hash
+# and longest side in pixels
+def _migrate_bill_thumbnails(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS bill_thumbnails (
+            hash TEXT NOT NULL REFERENCES bills(hash),
+            size INTEGER NOT NULL,
+            data BLOB NOT NULL,
+            PRIMARY KEY (hash, size)
+        )
+    ''')
+
+
+# Migration 7: full-text index over the free-text expense fields, stored as an
+# external-content FTS5 table over expenses and kept in sync by triggers
+def _migrate_expense_search(conn):
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS expenses_fts USING fts5(
+            description, company_name, contact_details,
+            content='expenses', content_rowid='id'
+        )
+    ''')
+
+    add_new = '''
+        INSERT INTO expenses_fts (rowid, description, company_name, contact_details)
+        VALUES (NEW.id, NEW.description, NEW.company_name, NEW.contact_details);
+    '''
+    remove_old = '''
+        INSERT INTO expenses_fts (expenses_fts, rowid, description, company_name, contact_details)
+        VALUES ('delete', OLD.id, OLD.description, OLD.company_name, OLD.contact_details);
+    '''
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS expenses_fts_insert AFTER INSERT ON expenses BEGIN {add_new} END")
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS expenses_fts_delete AFTER DELETE ON expenses BEGIN {remove_old} END")
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS expenses_fts_update
+        AFTER UPDATE OF description, company_name, contact_details ON expenses
+        BEGIN {remove_old} {add_new} END
+    ''')
+
+    conn.execute("INSERT INTO expenses_fts (expenses_fts) VALUES ('rebuild')")
+
+
+# Function to create the triggers that bump a month's snapshot version on
+# every write to it; month_sql is the month expression over the expenses
+# columns and columns the columns whose update can change the snapshot
+def _create_snapshot_triggers(conn, month_sql, columns):
+    def bump(row):
+        month = month_sql.replace("purchase_", f"{row}.purchase_")
+        return f'''
+            INSERT INTO snapshot_versions (month, version) VALUES ({month}, 1)
+            ON CONFLICT (month) DO UPDATE SET version = version + 1;
+        '''
+
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS expenses_snapshot_insert AFTER INSERT ON expenses BEGIN {bump('NEW')} END")
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS expenses_snapshot_delete AFTER DELETE ON expenses BEGIN {bump('OLD')} END")
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS expenses_snapshot_update
+        AFTER UPDATE OF {columns} ON expenses
+        BEGIN {bump('OLD')} {bump('NEW')} END
+    ''')
+
+
+# Migration 8: a version per purchase month, bumped by triggers on every write
+# to that month, so Parquet snapshots only rewrite the months that changed
+def _migrate_snapshot_versions(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS snapshot_versions (
+            month TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
+
+    # Months were taken from the purchase_date text until migration 9
+    month_sql = "IFNULL(substr(purchase_date, 1, 7), '')"
+    _create_snapshot_triggers(conn, month_sql, "date, amount, purpose, description, purchase_date, company_name, contact_details, username, bill_hash")
+    conn.execute(f'''
+        INSERT OR IGNORE INTO snapshot_versions (month, version)
+        SELECT DISTINCT {month_sql}, 1 FROM expenses
+    ''')
+
+
+# Migration 9: integer copies of the expense dates, epoch seconds for date and
+# a day number for purchase_date, which replace the text columns in every
+# index; see dates.py
+def _migrate_integer_dates(conn):
+    conn.execute("ALTER TABLE expenses ADD COLUMN date_ts INTEGER")
+    conn.execute("ALTER TABLE expenses ADD COLUMN purchase_day INTEGER")
+    conn.execute(f"UPDATE expenses SET date_ts = {DATE_TS_SQL}, purchase_day = {PURCHASE_DAY_SQL}")
+
+    conn.execute("DROP INDEX IF EXISTS idx_expenses_purchase_date")
+    conn.execute("DROP INDEX IF EXISTS idx_expenses_purpose_purchase_date")
+    conn.execute("DROP INDEX IF EXISTS idx_expenses_username_purchase_date")
+    conn.execute("DROP INDEX IF EXISTS idx_expenses_date")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_expenses_purchase_day ON expenses (purchase_day)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_expenses_purpose_purchase_day ON expenses (purpose, purchase_day)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_expenses_username_purchase_day ON expenses (username, purchase_day)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_expenses_date_ts ON expenses (date_ts DESC)")
+
+    # The app's writers set the integers themselves; these only fire for
+    # writers that set or change the text alone
+    new_date_ts = DATE_TS_SQL.replace("date)", "NEW.date)")
+    new_purchase_day = PURCHASE_DAY_SQL.replace("purchase_date", "NEW.purchase_date")
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS expenses_dates_insert AFTER INSERT ON expenses
+        WHEN (NEW.date_ts IS NULL AND NEW.date IS NOT NULL)
+        OR (NEW.purchase_day IS NULL AND NEW.purchase_date IS NOT NULL)
+        BEGIN
+            UPDATE expenses SET date_ts = IFNULL(NEW.date_ts, {new_date_ts}),
+            purchase_day = IFNULL(NEW.purchase_day, {new_purchase_day}) WHERE id = NEW.id;
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS expenses_dates_update AFTER UPDATE OF date, purchase_date ON expenses
+        WHEN (NEW.date IS NOT OLD.date AND NEW.date_ts IS OLD.date_ts)
+        OR (NEW.purchase_date IS NOT OLD.purchase_date AND NEW.purchase_day IS OLD.purchase_day)
+        BEGIN
+            UPDATE expenses SET date_ts = {new_date_ts}, purchase_day = {new_purchase_day} WHERE id = NEW.id;
+        END
+    ''')
+
+    # Snapshot months now come from purchase_day. Every month gets a new
+    # version, so the next snapshot is rewritten in full.
+    conn.execute("DROP TRIGGER IF EXISTS expenses_snapshot_insert")
+    conn.execute("DROP TRIGGER IF EXISTS expenses_snapshot_delete")
+    conn.execute("DROP TRIGGER IF EXISTS expenses_snapshot_update")
+    _create_snapshot_triggers(conn, SNAPSHOT_MONTH, "date_ts, amount, purpose, description, purchase_day, company_name, contact_details, username, bill_hash")
+    version = conn.execute("SELECT IFNULL(MAX(version), 0) + 1 FROM snapshot_versions").fetchone()[0]
+    conn.execute("DELETE FROM snapshot_versions")
+    conn.execute(f"INSERT INTO snapshot_versions (month, version) SELECT DISTINCT {SNAPSHOT_MONTH}, ? FROM expenses", (version,))
+
+
+# Migration 10: per-user indexes for the scoped reads, so one user's recent
+# expenses and purpose searches read only that user's rows
+def _migrate_user_scope_indexes(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_expenses_username_date_ts ON expenses (username, date_ts DESC)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_expenses_username_purpose_purchase_day ON expenses (username, purpose, purchase_day)")
+
+
+# Migration 11: users can be deactivated instead of deleted; an index on
+# (role, username) pages the Manage Users table filtered by role
+def _migrate_user_active(conn):
+    conn.execute("ALTER TABLE users ADD COLUMN active INTEGER NOT NULL DEFAULT 1")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_role_username ON users (role, username)")
+
+
+# Migration 12: bills record the size of the upload and the codec they are
+# stored in. Bills stored before uploads were compressed keep codec NULL
+# until recompress_bills processes them.
+def _migrate_bill_codecs(conn):
+    conn.execute("ALTER TABLE bills ADD COLUMN original_size INTEGER")
+    conn.execute("ALTER TABLE bills ADD COLUMN codec TEXT")
+    conn.execute("UPDATE bills SET original_size = size")
+
+
+# Migration 13: the registry of per-year archive files that old expenses are
+# moved into, the frozen rollups of the archived rows, and the bills archived
+# rows refer to, which must outlive their last expense in this file; see
+# archive.py
+def _migrate_archive_partitions(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS archive_partitions (
+            year INTEGER PRIMARY KEY,
+            file TEXT NOT NULL,
+            rows INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS archive_rollups (
+            username TEXT NOT NULL,
+            purpose TEXT NOT NULL,
+            day TEXT NOT NULL,
+            total REAL NOT NULL DEFAULT 0.0,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (username, purpose, day)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute("CREATE TABLE IF NOT EXISTS archived_bills (hash TEXT PRIMARY KEY) WITHOUT ROWID")
+
+
+# Migration 14: a change sequence for incremental readers; see frame.py.
+# Triggers stamp every updated expense with the next value of the one-row
+# expense_change_seq counter, and record the ids of deleted expenses in
+# expense_tombstones under theirs. Ids are AUTOINCREMENT and never reused,
+# so new expenses are found by id and inserts need no trigger. A reader that
+# remembers the highest id and the last counter value it saw fetches only
+# the rows written since.
+def _migrate_change_tracking(conn):
+    conn.execute("ALTER TABLE expenses ADD COLUMN change_seq INTEGER NOT NULL DEFAULT 0")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_expenses_change_seq ON expenses (change_seq)")
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS expense_change_seq (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            seq INTEGER NOT NULL
+        )
+    ''')
+    conn.execute("INSERT OR IGNORE INTO expense_change_seq (id, seq) VALUES (1, 0)")
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS expense_tombstones (
+            change_seq INTEGER PRIMARY KEY,
+            id INTEGER NOT NULL
+        )
+    ''')
+
+    next_seq = "UPDATE expense_change_seq SET seq = seq + 1 WHERE id = 1;"
+    stamp = "UPDATE expenses SET change_seq = (SELECT seq FROM expense_change_seq WHERE id = 1) WHERE id = NEW.id;"
+    # Any column but change_seq itself, which the trigger's own stamp sets
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS expenses_change_update AFTER UPDATE ON expenses
+        WHEN NEW.change_seq IS OLD.change_seq
+        BEGIN {next_seq} {stamp} END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS expenses_change_delete AFTER DELETE ON expenses
+        BEGIN
+            {next_seq}
+            INSERT INTO expense_tombstones (change_seq, id) SELECT seq, OLD.id FROM expense_change_seq WHERE id = 1;
+        END
+    ''')
+
+
+# Migration 15: the highest change_seq whose tombstones have been pruned;
+# readers behind it can't catch up from the tombstones and reload in full
+def _migrate_tombstone_horizon(conn):
+    conn.execute("ALTER TABLE expense_change_seq ADD COLUMN pruned_seq INTEGER NOT NULL DEFAULT 0")
+
+
+# Schema migrations in order; PRAGMA user_version records how many have run
+MIGRATIONS = [
+    _migrate_bills_table,
+    _migrate_expense_indexes,
+    _migrate_search_indexes,
+    _migrate_expense_rollups,
+    _migrate_user_totals,
+    _migrate_bill_thumbnails,
+    _migrate_expense_search,
+    _migrate_snapshot_versions,
+    _migrate_integer_dates,
+    _migrate_user_scope_indexes,
+    _migrate_user_active,
+    _migrate_bill_codecs,
+    _migrate_archive_partitions,
+    _migrate_change_tracking,
+    _migrate_tombstone_horizon,
+]
+
+
+def apply_migrations(conn):
+    # Each migration runs in its own write transaction, so DDL and data
+    # changes are rolled back together if any statement fails
+    while True:
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version >= len(MIGRATIONS):
+                return
+            MIGRATIONS[version](conn)
+            conn.execute(f"PRAGMA user_version = {version + 1}")
+
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+
+# Function to create the SQLite database and tables for expenses and users
+def create_tables():
+    global _schema_ready
+    if _schema_ready:
+        return
+
+    with _schema_lock:
+        if not _schema_ready:
+            initialize_schema(get_connection())
+            _schema_ready = True
+
+
+# Function to create the tables and apply migrations on the given connection
+def initialize_schema(conn):
+    with conn:
+        cursor = conn.cursor()
+
+        # Create the expenses table if it doesn't exist
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS expenses (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                amount REAL NOT NULL,
+                purpose TEXT NOT NULL,
+                description TEXT,
+                bill_image BLOB,
+                purchase_date DATE,
+                company_name TEXT,
+                contact_details TEXT,
+                username TEXT NOT NULL,  -- Added column for user association
+                FOREIGN KEY (username) REFERENCES users(username)  -- Adding foreign key constraint
+            )
+        ''')
+
+        # Create the users table if it doesn't exist
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                username TEXT PRIMARY KEY,
+                password TEXT NOT NULL,
+                role TEXT NOT NULL,
+                name TEXT,
+                contact_details TEXT,
+                total_expense REAL DEFAULT 0.0
+            )
+        ''')
+
+        # Add admin user if not exists (username: radha, password: kalki)
+        cursor.execute("SELECT COUNT(*) FROM users WHERE username = 'radha'")
+        if cursor.fetchone()[0] == 0:
+            # Hash the default password
+            hashed_password = hashlib.sha256("kalki".encode()).hexdigest()
+
+            # Insert the default admin user with name, contact_details, and role
+            cursor.execute("INSERT INTO users (username, password, role, name, contact_details) VALUES (?, ?, ?, ?, ?)",
+                           ("radha", hashed_password, "admin", "Kalki", "9511506378"))
+
+    apply_migrations(conn)
@@ -0,0 +1,259 @@
+from datetime import datetime
+
+from .db import get_connection
+from .cache import cached_read
+from .bills import prepare_bill, put_bill, release_bill
+from .dates import day_number, epoch_seconds
+from .archive import select_expenses
+from .writer import submit_write
+
+# Columns returned by the expense list queries. Bill images live in the bills
+# table, so position 5 holds the bill's hash rather than its bytes; position
+# 10 is the purchase date as a day number (see dates.py).
+EXPENSE_COLUMNS = "id, date, amount, purpose, description, bill_hash, purchase_date, company_name, contact_details, username, purchase_day"
+
+# Columns shown in the search results table; the full record is loaded with
+# get_expense() only when a row is opened
+EXPENSE_SUMMARY_COLUMNS = "id, purchase_date, amount, purpose, company_name"
+
+# Number of rows per page of search results
+SEARCH_PAGE_SIZE = 50
+
+# Date range pages, per purpose and per user. Each branch runs against the
+# hot table and the overlapping archive files (see archive.py); PAGE_ORDER
+# orders the combined rows by (purchase_day, id), which SQLite merges from
+# the branches' index order.
+PAGE_BRANCH = f"""
+    SELECT {EXPENSE_SUMMARY_COLUMNS}, purchase_day FROM {{expenses}}
+    WHERE purchase_day BETWEEN ? AND ?
+    AND (purchase_day, id) > (?, ?)
+"""
+USER_PAGE_BRANCH = f"""
+    SELECT {EXPENSE_SUMMARY_COLUMNS}, purchase_day FROM {{expenses}}
+    WHERE username = ?
+    AND purchase_day BETWEEN ? AND ?
+    AND (purchase_day, id) > (?, ?)
+"""
+PURPOSE_PAGE_BRANCH = f"""
+    SELECT {EXPENSE_SUMMARY_COLUMNS}, purchase_day FROM {{expenses}}
+    WHERE purpose = ?
+    AND purchase_day BETWEEN ? AND ?
+    AND (purchase_day, id) > (?, ?)
+"""
+USER_PURPOSE_PAGE_BRANCH = f"""
+    SELECT {EXPENSE_SUMMARY_COLUMNS}, purchase_day FROM {{expenses}}
+    WHERE username = ?
+    AND purpose = ?
+    AND purchase_day BETWEEN ? AND ?
+    AND (purchase_day, id) > (?, ?)
+"""
+PAGE_ORDER = "ORDER BY purchase_day, id LIMIT ?"
+
+# A single expense by id; archived expenses keep their ids
+EXPENSE_BRANCH = f"SELECT {EXPENSE_COLUMNS} FROM {{expenses}} WHERE id = ? AND (? IS NULL OR username = ?)"
+
+
+# Function to get the current time in India, which expenses are recorded in
+def india_now():
+    import pytz
+
+    return datetime.now(pytz.timezone('Asia/Kolkata'))
+
+
+# Function to split a page fetched with one extra row into the page and the
+# cursor of the next page, if there is one. Each row ends with its
+# purchase_day, which is only needed for the cursor and is dropped.
+def _keyset_page(records, limit):
+    next_cursor = None
+    if len(records) > limit:
+        records = records[:limit]
+        next_cursor = (records[-1][-1], records[-1][0])
+    return [record[:-1] for record in records], next_cursor
+
+
+# Every read takes a username scope: a username limits the rows to that
+# user's and is answered from a (username, ...) index, so its cost follows
+# that user's history; None reads every user's rows (admin only). The two
+# cases are separate statements because "? IS NULL OR username = ?" would
+# stop the planner from using the username indexes.
+
+
+# Function to fetch a date range page, one extra row included, from the hot
+# table and the archives between start_day and end_day
+def _range_page(branch, start_day, end_day, params, limit):
+    conn = get_connection()
+    records = []
+    for cursor in select_expenses(conn, branch, start_day, end_day, params, PAGE_ORDER, (limit + 1,)):
+        records += cursor.fetchmany(limit + 1 - len(records))
+        if len(records) > limit:
+            break
+    return _keyset_page(records, limit)
+
+
+# Function to retrieve one page of expenses for a purpose within the given
+# date range, ordered by (purchase_day, id). Returns the page and the cursor
+# to pass as after for the next page (None on the last page).
+@cached_read
+def get_expenses_by_purpose_and_date_range(purpose, start_date, end_date, after=None, limit=SEARCH_PAGE_SIZE, username=None):
+    # The cursor's day doubles as the lower bound, so the index seeks
+    # straight to the page instead of skipping the earlier rows, and archives
+    # of earlier years are not attached
+    after_day, after_id = after or (day_number(start_date), 0)
+    if username is None:
+        return _range_page(PURPOSE_PAGE_BRANCH, after_day, day_number(end_date),
+                           lambda first, last: (purpose, first, last, after_day, after_id), limit)
+    return _range_page(USER_PURPOSE_PAGE_BRANCH, after_day, day_number(end_date),
+                       lambda first, last: (username, purpose, first, last, after_day, after_id), limit)
+
+
+# Function to retrieve one page of expenses within the given date range,
+# ordered by (purchase_day, id); see get_expenses_by_purpose_and_date_range
+@cached_read
+def get_expenses_by_date_range(start_date, end_date, after=None, limit=SEARCH_PAGE_SIZE, username=None):
+    after_day, after_id = after or (day_number(start_date), 0)
+    if username is None:
+        return _range_page(PAGE_BRANCH, after_day, day_number(end_date),
+                           lambda first, last: (first, last, after_day, after_id), limit)
+    return _range_page(USER_PAGE_BRANCH, after_day, day_number(end_date),
+                       lambda first, last: (username, first, last, after_day, after_id), limit)
+
+
+# Function to turn free text into an FTS5 query that matches rows containing
+# every word, each as a prefix
+def _fts_query(text):
+    words = text.split()
+    return " ".join('"' + word.replace('"', '""') + '"*' for word in words)
+
+
+# Function to retrieve one page of expenses whose description, company name or
+# contact details match the text, best match first, within the date range and
+# optionally one purpose. Ranked results are paged by offset; the cursor is
+# the offset of the next page.
+@cached_read
+def search_expenses(text, purpose, start_date, end_date, after=None, limit=SEARCH_PAGE_SIZE, username=None):
+    offset = after or 0
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT e.id, e.purchase_date, e.amount, e.purpose, e.company_name
+        FROM expenses_fts
+        JOIN expenses e ON e.id = expenses_fts.rowid
+        WHERE expenses_fts MATCH ?
+        AND e.purchase_day BETWEEN ? AND ?
+        AND (? IS NULL OR e.purpose = ?)
+        AND (? IS NULL OR e.username = ?)
+        ORDER BY expenses_fts.rank
+        LIMIT ? OFFSET ?
+    ''', (_fts_query(text), day_number(start_date), day_number(end_date), purpose, purpose,
+          username, username, limit + 1, offset))
+    records = cursor.fetchall()
+    if len(records) > limit:
+        return records[:limit], offset + limit
+    return records, None
+
+
+# Function to retrieve a single expense with all of its details, archived or
+# not; with a username, only if the expense belongs to that user
+@cached_read
+def get_expense(expense_id, username=None):
+    conn = get_connection()
+    for cursor in select_expenses(conn, EXPENSE_BRANCH, None, None, lambda first, last: (expense_id, username, username)):
+        record = cursor.fetchone()
+        if record:
+            return record
+    return None
+
+
+# Function to retrieve all expenses, or all of one user's, in the hot
+# database; archived years are read-only and not listed
+@cached_read
+def get_expenses(username=None):
+    conn = get_connection()
+    cursor = conn.cursor()
+    if username is None:
+        cursor.execute(f"SELECT {EXPENSE_COLUMNS} FROM expenses")
+    else:
+        cursor.execute(f"SELECT {EXPENSE_COLUMNS} FROM expenses WHERE username = ? ORDER BY purchase_day, id", (username,))
+    records = cursor.fetchall()
+    return records
+
+
+# Function to retrieve the last 5 expenses, or one user's last 5
+@cached_read
+def get_recent_expenses(username=None):
+    conn = get_connection()
+    cursor = conn.cursor()
+    if username is None:
+        cursor.execute(f"SELECT {EXPENSE_COLUMNS} FROM expenses ORDER BY date_ts DESC LIMIT 5")
+    else:
+        cursor.execute(f"SELECT {EXPENSE_COLUMNS} FROM expenses WHERE username = ? ORDER BY date_ts DESC LIMIT 5", (username,))
+    records = cursor.fetchall()
+    return records
+
+
+# Function to insert an expense on the writer's connection; see insert_expense
+def _insert_expense(conn, now, username, amount, purpose, description, purchase_date, bill, company_name, contact_details):
+    bill_hash = put_bill(conn, bill)
+    cursor = conn.execute('''
+        INSERT INTO expenses (date, date_ts, amount, purpose, description, purchase_date, purchase_day, bill_hash, company_name, contact_details, username)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (now.strftime("%Y-%m-%d %H:%M:%S"), epoch_seconds(now), amount, purpose, description, purchase_date, day_number(purchase_date),
+          bill_hash, company_name, contact_details, username))
+    return cursor.lastrowid
+
+
+# Function to reject a write to an expense that is not in the hot table;
+# archived years are read-only
+def _missing_expense(expense_id):
+    return ValueError(f"Expense {expense_id} does not exist or is archived; archived expenses can't be changed")
+
+
+# Function to update an expense on the writer's connection; see update_expense
+def _update_expense(conn, expense_id, amount, purpose, description, purchase_date, bill, company_name, contact_details):
+    old_hash = conn.execute("SELECT bill_hash FROM expenses WHERE id = ?", (expense_id,)).fetchone()
+    if old_hash is None:
+        raise _missing_expense(expense_id)
+    old_hash = old_hash[0]
+    bill_hash = put_bill(conn, bill) if bill else old_hash
+    conn.execute('''
+        UPDATE expenses
+        SET amount = ?, purpose = ?, description = ?, purchase_date = ?, purchase_day = ?, bill_hash = ?, company_name = ?, contact_details = ?
+        WHERE id = ?
+    ''', (amount, purpose, description, purchase_date, day_number(purchase_date), bill_hash, company_name, contact_details, expense_id))
+    if old_hash != bill_hash:
+        release_bill(conn, old_hash)
+
+
+# Function to delete an expense on the writer's connection; see delete_expense
+def _delete_expense(conn, expense_id):
+    row = conn.execute("SELECT bill_hash FROM expenses WHERE id = ?", (expense_id,)).fetchone()
+    if conn.execute("DELETE FROM expenses WHERE id = ?", (expense_id,)).rowcount == 0:
+        raise _missing_expense(expense_id)
+    release_bill(conn, row[0])
+
+
+# Expense writes go through the writer thread (see writer.py): each function
+# prepares what it can in the caller's thread - the timestamp, the bill's
+# compression and thumbnails - queues the write and returns a Future, so the
+# caller can wait on .result() to confirm it or see its error.
+
+# Function to insert a new expense record for the given user; the Future
+# holds its id
+def insert_expense(username, amount, purpose, description, purchase_date, bill_image, company_name, contact_details):
+    if not username:
+        raise ValueError("An expense must belong to a user")
+
+    # Get the current time in India timezone
+    now = india_now()
+    return submit_write(_insert_expense, now, username, amount, purpose, description, purchase_date, prepare_bill(bill_image),
+                        company_name, contact_details)
+
+
+# Function to update an expense; a bill_image of None keeps the current bill
+def update_expense(expense_id, amount, purpose, description, purchase_date, bill_image, company_name, contact_details):
+    return submit_write(_update_expense, expense_id, amount, purpose, description, purchase_date, prepare_bill(bill_image),
+                        company_name, contact_details)
+
+
+def delete_expense(expense_id):
+    return submit_write(_delete_expense, expense_id)
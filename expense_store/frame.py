@@ -0,0 +1,146 @@
+# In-memory pandas frame of the hot expenses for pages that list every
+# expense, kept current from the change sequence (migration 14 in db.py)
+# instead of being read again on every Streamlit rerun.
+
+import os
+import threading
+
+from .db import get_connection
+
+# Columns held in the frame, indexed by id; bills and timestamps are left out
+FRAME_COLUMNS = "id, amount, purpose, description, purchase_date, purchase_day, company_name, contact_details, username"
+FRAME_NAMES = FRAME_COLUMNS.split(", ")
+
+# Columns stored as categoricals, which repeat a few values across every row
+CATEGORY_COLUMNS = ["purpose", "username"]
+
+# Tombstones kept when pruning, counted in changes; a frame further behind
+# than that reloads in full
+TOMBSTONE_KEEP = int(os.environ.get("EXPENSE_TOMBSTONE_KEEP", "10000"))
+
+# Expenses listed per page of a frame
+FRAME_PAGE_SIZE = 100
+
+
+# Function to turn rows into a typed frame: amount float64, purpose and
+# username categorical, purchase_day a nullable integer
+def _to_frame(rows):
+    import pandas as pd
+
+    frame = pd.DataFrame.from_records(rows, columns=FRAME_NAMES, index="id")
+    return frame.astype({"amount": "float64", "purpose": "category", "username": "category", "purchase_day": "Int64"})
+
+
+# Function to merge changed rows and deleted ids into the frame. Changed
+# rows replace their old version; a deleted id whose row is among the
+# changed rows was inserted again after the delete.
+def _merge(frame, rows, deleted):
+    import pandas as pd
+
+    changed = _to_frame(rows)
+    frame = frame.drop(index=frame.index.intersection(changed.index.union(pd.Index(deleted))))
+    # Categoricals only concatenate as categoricals with the same categories
+    for column in CATEGORY_COLUMNS:
+        categories = frame[column].cat.categories.union(changed[column].cat.categories)
+        frame[column] = frame[column].cat.set_categories(categories)
+        changed[column] = changed[column].cat.set_categories(categories)
+    return pd.concat([frame, changed]).sort_index()
+
+
+class ExpenseFrame:
+    """The hot expenses as a DataFrame, refreshed incrementally.
+
+    The first access loads every row, and so does the first after the
+    tombstones a frame still needs have been pruned. Later accesses read the highest id and
+    the change counter and, if either moved, only the rows added, the rows
+    stamped and the tombstones recorded since the last access, so a rerun
+    with nothing new costs two indexed lookups. The per-user views are kept
+    until the next change. Frames handed out are shared and must not be
+    modified.
+    """
+
+    def __init__(self):
+        self._frame = None
+        self._seq = None
+        self._max_id = None
+        self._views = {}
+        self._lock = threading.Lock()
+
+    def _load(self, conn):
+        return _to_frame(conn.execute(f"SELECT {FRAME_COLUMNS} FROM expenses").fetchall())
+
+    def _refresh(self):
+        conn = get_connection()
+        # One read transaction, so the counter, rows and tombstones agree
+        with conn:
+            conn.execute("BEGIN")
+            seq, pruned_seq, max_id = conn.execute('''
+                SELECT seq, pruned_seq, (SELECT IFNULL(MAX(id), 0) FROM expenses) FROM expense_change_seq WHERE id = 1
+            ''').fetchone()
+            if seq == self._seq and max_id <= self._max_id:
+                return
+            # A counter behind the frame means the database was replaced; a
+            # frame behind the pruned tombstones can't see every delete
+            if self._frame is None or seq < self._seq or self._seq < pruned_seq:
+                self._frame = self._load(conn)
+            else:
+                rows = conn.execute(f'''
+                    SELECT {FRAME_COLUMNS} FROM expenses WHERE id > ?
+                    UNION
+                    SELECT {FRAME_COLUMNS} FROM expenses WHERE change_seq > ?
+                ''', (self._max_id, self._seq)).fetchall()
+                deleted = [row[0] for row in conn.execute("SELECT id FROM expense_tombstones WHERE change_seq > ?", (self._seq,))]
+                self._frame = _merge(self._frame, rows, deleted)
+                # The highest id can drop when the newest expense is deleted
+                max_id = max(max_id, self._max_id)
+        self._seq = seq
+        self._max_id = max_id
+        self._views.clear()
+
+    def get(self, username=None, purpose=None):
+        with self._lock:
+            self._refresh()
+            view = self._views.get((username, purpose))
+            if view is None:
+                view = self._frame
+                if purpose is not None:
+                    view = view[view["purpose"] == purpose]
+                if username is not None:
+                    view = view[view["username"] == username].sort_values(["purchase_day", "id"], na_position="first")
+                self._views[(username, purpose)] = view
+            return view
+
+
+_expense_frame = ExpenseFrame()
+
+
+# Function to get every hot expense, or one user's ordered by purchase day,
+# optionally of one purpose, as a DataFrame indexed by id; see ExpenseFrame
+def get_expense_frame(username=None, purpose=None):
+    return _expense_frame.get(username, purpose)
+
+
+# Function to get one page of a frame from get_expense_frame, counting from
+# 1, and the number of pages
+def frame_page(frame, page):
+    pages = max(1, -(-len(frame) // FRAME_PAGE_SIZE))
+    page = min(max(page, 1), pages)
+    return frame.iloc[(page - 1) * FRAME_PAGE_SIZE:page * FRAME_PAGE_SIZE], pages
+
+
+# Function to get one expense of a frame as a dict of plain Python values,
+# with None for missing ones
+def frame_row(frame, expense_id):
+    row = frame.loc[[expense_id]].astype(object)
+    return row.where(row.notna(), None).to_dict("records")[0]
+
+
+# Function to drop the tombstones of all but the last keep changes and record
+# how far they have been pruned. Returns the number of tombstones removed.
+def prune_tombstones(conn, keep=TOMBSTONE_KEEP):
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        horizon = conn.execute("SELECT seq - ? FROM expense_change_seq WHERE id = 1", (keep,)).fetchone()[0]
+        removed = conn.execute("DELETE FROM expense_tombstones WHERE change_seq <= ?", (horizon,)).rowcount
+        conn.execute("UPDATE expense_change_seq SET pruned_seq = MAX(pruned_seq, ?) WHERE id = 1", (horizon,))
+    return removed
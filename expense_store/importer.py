@@ -0,0 +1,159 @@
+import csv
+import io
+import math
+import time
+from datetime import date, datetime
+
+from .db import get_connection
+from .cache import invalidates
+from .expenses import india_now
+from .dates import day_number, epoch_seconds
+
+# Expense categories accepted by the forms and the importer
+PURPOSES = ["Books", "Electronics", "Event", "Marketing", "Operations", "Travel", "Miscellaneous"]
+
+# Rows inserted per transaction
+IMPORT_CHUNK_SIZE = 5000
+
+# Rejected rows kept for the report; the rest are only counted
+MAX_REPORTED_REJECTIONS = 1000
+
+# Columns read from the file. Headers are matched case-insensitively with
+# spaces treated as underscores, so the Download Reports export imports as is.
+REQUIRED_COLUMNS = ["amount", "purpose", "purchase_date"]
+OPTIONAL_COLUMNS = ["description", "company_name", "contact_details", "username", "date"]
+
+
+class ExpenseImportError(ValueError):
+    """Raised when an import file cannot be read at all."""
+
+
+def _normalize_header(header):
+    return str(header or "").strip().lower().replace(" ", "_")
+
+
+def _parse_date(value):
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    return date.fromisoformat(str(value).strip()[:10]).isoformat()
+
+
+def _iter_csv(file):
+    reader = csv.reader(io.TextIOWrapper(file, encoding="utf-8-sig", newline=""))
+    yield from reader
+
+
+def _iter_xlsx(file):
+    import openpyxl
+
+    # read_only mode streams rows from the sheet instead of loading it whole
+    workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+    try:
+        yield from workbook.active.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+# Function to check and convert one parsed row into the values inserted into
+# expenses. Raises ValueError with the reason a row is rejected.
+def _expense_values(record, default_username, known_users, recorded_at):
+    try:
+        amount = float(record["amount"])
+    except (TypeError, ValueError):
+        raise ValueError(f"invalid amount {record['amount']!r}")
+    # nan and inf parse as floats but are not amounts
+    if not math.isfinite(amount) or amount <= 0:
+        raise ValueError("amount must be a positive number")
+
+    purpose = str(record["purpose"] or "").strip()
+    if purpose not in PURPOSES:
+        raise ValueError(f"unknown purpose {purpose!r}")
+
+    try:
+        purchase_date = _parse_date(record["purchase_date"])
+    except (TypeError, ValueError):
+        raise ValueError(f"invalid purchase date {record['purchase_date']!r}")
+
+    username = str(record.get("username") or default_username).strip()
+    if username not in known_users:
+        raise ValueError(f"unknown user {username!r}")
+
+    recorded = record.get("date") or recorded_at
+    try:
+        if not isinstance(recorded, datetime):
+            recorded = datetime.fromisoformat(str(recorded).strip())
+    except ValueError:
+        raise ValueError(f"invalid date {record['date']!r}")
+
+    return (recorded.strftime("%Y-%m-%d %H:%M:%S"), epoch_seconds(recorded), amount, purpose, record.get("description"),
+            purchase_date, day_number(purchase_date), record.get("company_name"), record.get("contact_details"), username)
+
+
+# Function to import expenses from a CSV or XLSX file. Rows are parsed as a
+# stream and inserted with executemany, one transaction per chunk. Returns a
+# dict with the inserted and rejected counts, the rejected rows as
+# (line number, reason), the elapsed seconds and the rows per second.
+@invalidates
+def import_expenses(file, file_name, default_username, chunk_size=IMPORT_CHUNK_SIZE):
+    started = time.perf_counter()
+    if file_name.lower().endswith(".xlsx"):
+        rows = _iter_xlsx(file)
+    elif file_name.lower().endswith(".csv"):
+        rows = _iter_csv(file)
+    else:
+        raise ExpenseImportError("Only .csv and .xlsx files can be imported")
+
+    header = [_normalize_header(column) for column in next(rows, [])]
+    missing = [column for column in REQUIRED_COLUMNS if column not in header]
+    if missing:
+        raise ExpenseImportError(f"Missing column(s): {', '.join(missing)}")
+    positions = {column: header.index(column) for column in REQUIRED_COLUMNS + OPTIONAL_COLUMNS if column in header}
+
+    conn = get_connection()
+    known_users = {row[0] for row in conn.execute("SELECT username FROM users")}
+    recorded_at = india_now()
+
+    inserted = 0
+    rejected_count = 0
+    rejected = []
+    chunk = []
+
+    def flush():
+        with conn:
+            conn.executemany('''
+                INSERT INTO expenses (date, date_ts, amount, purpose, description, purchase_date, purchase_day, company_name, contact_details, username)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', chunk)
+
+    # Line 1 is the header
+    for line, row in enumerate(rows, start=2):
+        if not row or all(value in (None, "") for value in row):
+            continue
+        record = {column: row[position] if position < len(row) else None for column, position in positions.items()}
+        try:
+            chunk.append(_expense_values(record, default_username, known_users, recorded_at))
+        except ValueError as error:
+            rejected_count += 1
+            if len(rejected) < MAX_REPORTED_REJECTIONS:
+                rejected.append((line, str(error)))
+            continue
+
+        if len(chunk) >= chunk_size:
+            flush()
+            inserted += len(chunk)
+            chunk = []
+
+    if chunk:
+        flush()
+        inserted += len(chunk)
+
+    elapsed = time.perf_counter() - started
+    return {
+        "inserted": inserted,
+        "rejected": rejected_count,
+        "rejected_rows": rejected,
+        "seconds": elapsed,
+        "rows_per_second": inserted / elapsed if elapsed > 0 else 0.0,
+    }
@@ -0,0 +1,228 @@
+import itertools
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from .db import get_connection
+from .reports import REPORT_FORMATS, count_report_rows
+
+# Reports generated at the same time; the rest wait in the queue
+REPORT_WORKERS = 2
+
+# Finished report files kept for reuse; the oldest are deleted beyond this
+REPORT_CACHE_MAX_FILES = 16
+
+# Directory the finished report files are written to
+REPORT_DIR = os.environ.get("EXPENSE_REPORT_DIR", os.path.join(tempfile.gettempdir(), "expense_reports"))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class ReportCancelled(Exception):
+    """Raised inside a report writer when its job has been cancelled."""
+
+
+class ReportJob:
+    """A report being generated in the background.
+
+    path is the finished file, or None when the report has no rows.
+    """
+
+    def __init__(self, job_id, key):
+        self.id = job_id
+        self.key = key
+        self.report_format, self.start_date, self.end_date, self.purpose, self.username, self.version = key
+        self.status = QUEUED
+        self.rows_written = 0
+        self.total_rows = None
+        self.path = None
+        self.error = None
+        self.cancel_requested = threading.Event()
+        self.future = None
+
+    @property
+    def progress(self):
+        if self.status == DONE:
+            return 1.0
+        if not self.total_rows:
+            return 0.0
+        return min(self.rows_written / self.total_rows, 1.0)
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED, CANCELLED)
+
+    @property
+    def file_name(self):
+        return f"expense_report_{self.start_date}_{self.end_date}.{REPORT_FORMATS[self.report_format][1]}"
+
+    @property
+    def mime(self):
+        return REPORT_FORMATS[self.report_format][2]
+
+    def _progress(self, rows_written):
+        self.rows_written = rows_written
+        if self.cancel_requested.is_set():
+            raise ReportCancelled()
+
+
+# Function to read the version of the expense data as stored, which writes
+# from every process change: the change counter moves on updates and deletes
+# (archiving a year included), the highest id on inserts, and the archived
+# row count when deleted users' archived expenses are purged
+def _stored_version():
+    return get_connection().execute('''
+        SELECT (SELECT seq FROM expense_change_seq WHERE id = 1),
+               (SELECT IFNULL(MAX(id), 0) FROM expenses),
+               (SELECT IFNULL(SUM(rows), 0) FROM archive_partitions)
+    ''').fetchone()
+
+
+class ReportQueue:
+    """Runs report jobs on a thread pool and keeps finished files for reuse.
+
+    Jobs are keyed by format, date range, purpose and user filters and the
+    version of the data stored in the database (see _stored_version), so
+    asking for a report that is already queued, running or finished returns
+    the existing job instead of generating it again. Any write, from this
+    process or another, changes the version, after which the same request
+    starts a new job, and so does a finished report whose file has gone.
+    """
+
+    def __init__(self, workers, max_files, directory):
+        self.max_files = max_files
+        self.directory = directory
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="report")
+        self._ids = itertools.count(1)
+        self._jobs = {}
+        self._by_key = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, report_format, start_date, end_date, purpose=None, username=None):
+        if report_format not in REPORT_FORMATS:
+            raise ValueError(f"Unknown report format {report_format!r}")
+        key = (report_format, str(start_date), str(end_date), purpose, username, _stored_version())
+        with self._lock:
+            job = self._by_key.get(key)
+            if job is not None:
+                # Temp cleaners or a restart may have removed the file
+                expired = job.status == DONE and job.path is not None and not os.path.exists(job.path)
+                if job.status not in (FAILED, CANCELLED) and not expired:
+                    self._by_key.move_to_end(key)
+                    return job
+                del self._jobs[job.id]
+            job = ReportJob(next(self._ids), key)
+            self._jobs[job.id] = job
+            self._by_key[key] = job
+            self._by_key.move_to_end(key)
+            job.future = self._executor.submit(self._run, job)
+            return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is None or job.finished:
+            return False
+        job.cancel_requested.set()
+        # A job that has not started yet is dropped from the queue directly
+        if job.future.cancel():
+            job.status = CANCELLED
+        return True
+
+    def _run(self, job):
+        if job.cancel_requested.is_set():
+            job.status = CANCELLED
+            return
+        job.status = RUNNING
+        writer, extension, _ = REPORT_FORMATS[job.report_format]
+        os.makedirs(self.directory, exist_ok=True)
+        fd, path = tempfile.mkstemp(prefix=f"report_{job.id}_", suffix=f".{extension}", dir=self.directory)
+        try:
+            job.total_rows = count_report_rows(job.start_date, job.end_date, job.purpose, job.username)
+            with os.fdopen(fd, "wb") as report_file:
+                row_count = writer(report_file, job.start_date, job.end_date, job.purpose, job._progress,
+                                   username=job.username)
+        except ReportCancelled:
+            os.remove(path)
+            job.status = CANCELLED
+            return
+        except Exception as error:
+            os.remove(path)
+            job.error = str(error)
+            job.status = FAILED
+            return
+
+        if row_count:
+            job.path = path
+        else:
+            os.remove(path)
+        job.status = DONE
+        self._evict()
+
+    # Forget the oldest finished jobs beyond max_files and delete their files
+    def _evict(self):
+        with self._lock:
+            finished = [job for job in self._by_key.values() if job.finished]
+            for job in finished[:max(len(finished) - self.max_files, 0)]:
+                del self._by_key[job.key]
+                del self._jobs[job.id]
+                if job.path:
+                    try:
+                        os.remove(job.path)
+                    except FileNotFoundError:
+                        pass
+                    job.path = None
+
+    def stats(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return {
+            "queued": sum(job.status == QUEUED for job in jobs),
+            "running": sum(job.status == RUNNING for job in jobs),
+            "cached": sum(job.status == DONE and job.path is not None for job in jobs),
+        }
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+# Function to get the process-wide report queue, creating it on first use
+def get_report_queue():
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = ReportQueue(REPORT_WORKERS, REPORT_CACHE_MAX_FILES, REPORT_DIR)
+    return _queue
+
+
+# Function to queue a report and return its job; an identical report for the
+# current data already queued, running or finished is returned instead. A
+# username limits the report to that user's expenses.
+def submit_report(report_format, start_date, end_date, purpose=None, username=None):
+    return get_report_queue().submit(report_format, start_date, end_date, purpose, username)
+
+
+# Function to look up a report job by id
+def get_report_job(job_id):
+    return get_report_queue().get(job_id)
+
+
+# Function to cancel a queued or running report job
+def cancel_report_job(job_id):
+    return get_report_queue().cancel(job_id)
+
+
+# Function to report how many jobs are queued, running and cached
+def report_queue_stats():
+    return get_report_queue().stats()
@@ -0,0 +1,219 @@
+import functools
+import logging
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import deque
+
+# Queries slower than this, in milliseconds, are written to the slow-query log
+SLOW_QUERY_MS = float(os.environ.get("EXPENSE_SLOW_QUERY_MS", "100"))
+
+# Set EXPENSE_QUERY_PROFILE=0 to open plain connections without profiling
+PROFILE_QUERIES = os.environ.get("EXPENSE_QUERY_PROFILE", "1") != "0"
+
+# Samples kept per statement for the percentiles, and entries in the slow log
+PROFILE_SAMPLES = 500
+SLOW_LOG_SIZE = 200
+
+logger = logging.getLogger("expense_store.slow_queries")
+
+_THIS_FILE = os.path.abspath(__file__)
+
+
+# Function to reduce a statement to its fingerprint: whitespace collapsed and
+# literals replaced with ?, so the same query groups under one entry
+@functools.lru_cache(maxsize=1024)
+def fingerprint(sql):
+    sql = re.sub(r"'(?:[^']|'')*'", "?", sql)
+    sql = re.sub(r"\b\d+(?:\.\d+)?\b", "?", sql)
+    return " ".join(sql.split())
+
+
+# Function to name the function that ran a statement, as module.function
+def _origin():
+    frame = sys._getframe(2)
+    while frame and os.path.abspath(frame.f_code.co_filename) == _THIS_FILE:
+        frame = frame.f_back
+    if frame is None:
+        return ""
+    module = os.path.splitext(os.path.basename(frame.f_code.co_filename))[0]
+    return f"{module}.{frame.f_code.co_name}"
+
+
+# Function to estimate the bytes rows bring into Python: the length of text
+# and blob values, 8 bytes for numbers. Exact class checks keep this cheap on
+# reports that fetch every row.
+def _rows_bytes(rows):
+    size = 0
+    for row in rows:
+        for value in row:
+            if value.__class__ is str or value.__class__ is bytes:
+                size += len(value)
+            elif value is not None:
+                size += 8
+    return size
+
+
+class QueryProfiler:
+    """Per-statement timings, row counts and fetched bytes.
+
+    Each execute() starts a sample of [seconds, rows, bytes]; the fetches on
+    the same cursor add to it, so a sample covers the statement and reading
+    its results. Samples that pass the slow threshold are also logged.
+    """
+
+    def __init__(self, slow_seconds, samples, slow_log_size):
+        self.slow_seconds = slow_seconds
+        self.samples = samples
+        self._stats = {}
+        self._slow = deque(maxlen=slow_log_size)
+        self._lock = threading.Lock()
+
+    def start(self, sql):
+        key = fingerprint(sql)
+        # seconds, rows, bytes, whether it was logged as slow, fingerprint
+        sample = [0.0, 0, 0, False, key]
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = {"origin": _origin(), "calls": 0, "samples": deque(maxlen=self.samples)}
+            stats["calls"] += 1
+            stats["samples"].append(sample)
+        return sample
+
+    def add(self, sample, seconds, rows=0, size=0):
+        sample[0] += seconds
+        sample[1] += rows
+        sample[2] += size
+        if sample[0] >= self.slow_seconds and not sample[3]:
+            sample[3] = True
+            with self._lock:
+                self._slow.append((time.time(), sample))
+            logger.warning("slow query (%.1f ms): %s", sample[0] * 1000, sample[4])
+
+    def report(self):
+        with self._lock:
+            entries = [(key, stats["origin"], stats["calls"], list(stats["samples"])) for key, stats in self._stats.items()]
+        report = []
+        for key, origin, calls, samples in entries:
+            durations = sorted(sample[0] for sample in samples)
+            report.append({
+                "statement": key,
+                "origin": origin,
+                "calls": calls,
+                "total_ms": sum(durations) * 1000,
+                "p50_ms": _percentile(durations, 50) * 1000,
+                "p95_ms": _percentile(durations, 95) * 1000,
+                "p99_ms": _percentile(durations, 99) * 1000,
+                "max_ms": durations[-1] * 1000,
+                "rows_per_call": sum(sample[1] for sample in samples) / len(samples),
+                "bytes_per_call": sum(sample[2] for sample in samples) / len(samples),
+            })
+        report.sort(key=lambda entry: entry["total_ms"], reverse=True)
+        return report
+
+    def slow_queries(self):
+        with self._lock:
+            return [{"at": at, "statement": sample[4], "ms": sample[0] * 1000, "rows": sample[1], "bytes": sample[2]}
+                    for at, sample in reversed(self._slow)]
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self._slow.clear()
+
+
+# Nearest-rank percentile of sorted values
+def _percentile(values, percent):
+    index = max(0, -(-len(values) * percent // 100) - 1)
+    return values[int(index)]
+
+
+_profiler = QueryProfiler(SLOW_QUERY_MS / 1000, PROFILE_SAMPLES, SLOW_LOG_SIZE)
+
+
+class ProfilingCursor(sqlite3.Cursor):
+    """Cursor that records every statement and fetch with the profiler."""
+
+    _sample = None
+
+    def execute(self, sql, parameters=()):
+        self._sample = _profiler.start(sql)
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _profiler.add(self._sample, time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        self._sample = _profiler.start(sql)
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _profiler.add(self._sample, time.perf_counter() - started)
+
+    def _fetched(self, started, rows):
+        if self._sample is not None:
+            _profiler.add(self._sample, time.perf_counter() - started, len(rows), _rows_bytes(rows))
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(started, [row] if row is not None else [])
+        return row
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched(started, rows)
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(started, rows)
+        return rows
+
+    def __next__(self):
+        started = time.perf_counter()
+        row = super().__next__()
+        self._fetched(started, [row])
+        return row
+
+
+class ProfilingConnection(sqlite3.Connection):
+    """Connection whose cursors, including those made by the execute()
+    shortcuts, are ProfilingCursors."""
+
+    def cursor(self, factory=ProfilingCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+# Function to get the connection class for new connections
+def connection_factory():
+    return ProfilingConnection if PROFILE_QUERIES else sqlite3.Connection
+
+
+# Function to get per-statement timings, slowest total first
+def query_profile():
+    return _profiler.report()
+
+
+# Function to get the most recent slow queries, newest first
+def slow_queries():
+    return _profiler.slow_queries()
+
+
+# Function to clear the recorded timings and the slow-query log
+def reset_query_profile():
+    _profiler.reset()
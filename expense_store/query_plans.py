@@ -0,0 +1,112 @@
+import ast
+import os
+import re
+import sqlite3
+
+from .db import initialize_schema
+
+# Modules whose SQL statements are checked
+CHECKED_MODULES = ["expenses.py", "users.py", "dashboard.py", "bills.py", "reports.py", "rollups.py", "importer.py", "snapshot.py", "frame.py"]
+
+# Functions whose statements read every row on purpose, with the reason
+INTENTIONAL_SCANS = {
+    "users.get_users": "lists every user",
+    "rollups.reconcile_user_totals": "checks the total of every user",
+    "expenses.get_expenses": "returns every expense",
+    "dashboard.get_expense_summary": "aggregates the rollup table",
+    "dashboard.get_totals_by_purpose": "aggregates the rollup table",
+    "dashboard.get_monthly_totals": "aggregates the rollup table",
+    "bills.prune_bills": "maintenance sweep over every bill",
+    "bills.backfill_thumbnails": "maintenance sweep over every bill",
+    "bills.recompress_bills": "maintenance sweep over every bill",
+    "rollups.rebuild_rollups": "recomputes the rollups from every expense",
+    "rollups.verify_rollups": "checks the rollups against every expense",
+    "snapshot.export_snapshot": "reads the version of every month",
+    "frame._load": "loads every expense once per process",
+}
+
+# A plan step that reads a whole table without any index
+FULL_SCAN = re.compile(r"^SCAN (\w+)(?: AS \w+)?$")
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _module_constants(tree):
+    # String constants, including f-strings built from earlier constants
+    constants = {}
+    for node in tree.body:
+        if isinstance(node, ast.Assign):
+            value = _sql_text(node.value, constants)
+            if value is not None:
+                for target in node.targets:
+                    if isinstance(target, ast.Name):
+                        constants[target.id] = value
+    return constants
+
+
+def _sql_text(node, constants):
+    # Plain string literals, or f-strings built from module-level constants
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return node.value
+    if isinstance(node, ast.JoinedStr):
+        parts = []
+        for value in node.values:
+            if isinstance(value, ast.Constant):
+                parts.append(value.value)
+            elif isinstance(value, ast.FormattedValue) and isinstance(value.value, ast.Name) and value.value.id in constants:
+                parts.append(constants[value.value.id])
+            else:
+                return None
+        return "".join(parts)
+    return None
+
+
+# Function to collect (function name, SQL) for every execute() call in a module
+def collect_statements(filename):
+    module = os.path.splitext(os.path.basename(filename))[0]
+    with open(filename, encoding="utf-8") as source:
+        tree = ast.parse(source.read())
+    constants = _module_constants(tree)
+
+    statements = []
+    for function in ast.walk(tree):
+        if not isinstance(function, ast.FunctionDef):
+            continue
+        for call in ast.walk(function):
+            if (isinstance(call, ast.Call) and isinstance(call.func, ast.Attribute)
+                    and call.func.attr in ("execute", "executemany") and call.args):
+                statements.append((f"{module}.{function.name}", _sql_text(call.args[0], constants)))
+
+    # Branches run through archive.select_expenses, checked against the hot
+    # table under the name of the constant
+    for name, value in constants.items():
+        if "{expenses}" in value:
+            statements.append((f"{module}.{name}", value.format(expenses="expenses")))
+    return statements
+
+
+def _placeholders(sql):
+    # Count ? parameters outside of quoted literals
+    return sql.count("?") - sum(literal.count("?") for literal in re.findall(r"'[^']*'", sql))
+
+
+# Function to run EXPLAIN QUERY PLAN on every checked statement and return
+# a list of (function, sql, problem) for statements that fall back to a full scan
+def check_query_plans():
+    conn = sqlite3.connect(":memory:")
+    initialize_schema(conn)
+
+    problems = []
+    for module in CHECKED_MODULES:
+        for function, sql in collect_statements(os.path.join(BASE_DIR, module)):
+            if sql is None:
+                problems.append((function, None, "SQL is built dynamically and cannot be checked"))
+                continue
+            if not sql.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE", "WITH")):
+                continue
+            plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}", [None] * _placeholders(sql)).fetchall()
+            scans = [row[3] for row in plan if FULL_SCAN.match(row[3])]
+            if scans and function not in INTENTIONAL_SCANS:
+                problems.append((function, " ".join(sql.split()), "; ".join(scans)))
+    conn.close()
+    return problems
@@ -0,0 +1,442 @@
+import csv
+import functools
+import io
+import os
+import pickle
+import tempfile
+import threading
+import zlib
+
+from .db import get_connection
+from .bills import THUMBNAIL_SMALL
+from .dates import day_number
+from .archive import select_expenses
+from .analytics import select_report
+
+# Report columns; bill images are never selected
+REPORT_COLUMNS = "id, date, amount, purpose, description, purchase_date, company_name, contact_details, username"
+REPORT_HEADERS = ["ID", "Date", "Amount", "Purpose", "Description", "Purchase Date", "Company Name", "Contact Details", "Username"]
+
+# Columns of the PDF report; the bill hash is only used to look up its thumbnail
+PDF_COLUMNS = "purchase_date, purpose, company_name, description, amount, bill_hash"
+PDF_HEADERS = ["Purchase Date", "Purpose", "Company Name", "Description", "Amount"]
+
+# Width in mm of each PDF column, the bill thumbnail column, and row heights
+PDF_WIDTHS = [26, 28, 42, 64, 30]
+PDF_BILL_WIDTH = 16
+PDF_ROW_HEIGHT = 7
+PDF_BILL_ROW_HEIGHT = 16
+
+# The bundled Unicode font, so the rupee sign renders, and its pickled metrics
+FONT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FONT_PATH = os.path.join(FONT_DIR, "DejaVuSans.ttf")
+FONT_METRICS_PATH = os.path.join(FONT_DIR, "DejaVuSans.pkl")
+REPORT_FONT = "dejavu"
+
+# Rows fetched from the cursor at a time
+CHUNK_SIZE = 1000
+
+# Columns of the report queries. Row queries end with the sort columns, which
+# REPORT_ORDER uses to order the combined rows and which are dropped before
+# the rows are written.
+COUNT_SELECT = "COUNT(*)"
+REPORT_SELECT = f"{REPORT_COLUMNS}, purchase_day AS sort_day, id AS sort_id"
+PDF_SELECT = f"{PDF_COLUMNS}, purchase_day AS sort_day, id AS sort_id"
+
+# Report queries, as branches run against the hot table and the overlapping
+# archive files (see archive.py). A username limits the report to that user's
+# expenses and reads them through the (username, purchase_day) index.
+COUNT_BRANCH = f"""
+    SELECT {COUNT_SELECT} FROM {{expenses}}
+    WHERE purchase_day BETWEEN ? AND ?
+    AND (? IS NULL OR purpose = ?)
+"""
+USER_COUNT_BRANCH = f"""
+    SELECT {COUNT_SELECT} FROM {{expenses}}
+    WHERE username = ?
+    AND purchase_day BETWEEN ? AND ?
+    AND (? IS NULL OR purpose = ?)
+"""
+REPORT_BRANCH = f"""
+    SELECT {REPORT_SELECT} FROM {{expenses}}
+    WHERE purchase_day BETWEEN ? AND ?
+    AND (? IS NULL OR purpose = ?)
+"""
+USER_REPORT_BRANCH = f"""
+    SELECT {REPORT_SELECT} FROM {{expenses}}
+    WHERE username = ?
+    AND purchase_day BETWEEN ? AND ?
+    AND (? IS NULL OR purpose = ?)
+"""
+PDF_BRANCH = f"""
+    SELECT {PDF_SELECT} FROM {{expenses}}
+    WHERE purchase_day BETWEEN ? AND ?
+    AND (? IS NULL OR purpose = ?)
+"""
+USER_PDF_BRANCH = f"""
+    SELECT {PDF_SELECT} FROM {{expenses}}
+    WHERE username = ?
+    AND purchase_day BETWEEN ? AND ?
+    AND (? IS NULL OR purpose = ?)
+"""
+REPORT_ORDER = "ORDER BY sort_day, sort_id"
+
+# Reports smaller than this stay in memory, larger ones spill to a temp file
+SPOOL_MAX_SIZE = 1024 * 1024
+
+
+# Function to run a report query over the hot table and the archives for the
+# date range, with or without the user filter. Reports over every user run on
+# DuckDB when it is enabled (see analytics.py), with select as the columns.
+def _report_cursors(select, branch, user_branch, start_date, end_date, purpose, username, tail=""):
+    conn = get_connection()
+    if username is None:
+        cursors = select_report(select, day_number(start_date), day_number(end_date), purpose, tail)
+        if cursors is not None:
+            return cursors
+        return select_expenses(conn, branch, day_number(start_date), day_number(end_date),
+                               lambda first, last: (first, last, purpose, purpose), tail)
+    return select_expenses(conn, user_branch, day_number(start_date), day_number(end_date),
+                           lambda first, last: (username, first, last, purpose, purpose), tail)
+
+
+# Function to count the rows a report will contain, for progress reporting
+def count_report_rows(start_date, end_date, purpose=None, username=None):
+    cursors = _report_cursors(COUNT_SELECT, COUNT_BRANCH, USER_COUNT_BRANCH, start_date, end_date, purpose, username)
+    return sum(count for cursor in cursors for count, in cursor)
+
+
+# Function to yield the rows of the cursors in chunks, without their trailing
+# sort columns
+def _chunks(cursors, chunk_size):
+    for cursor in cursors:
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield [row[:-2] for row in rows]
+
+
+# Function to stream the report rows for a date range, optionally limited to
+# one purpose and one user, in chunks
+def iter_report_rows(start_date, end_date, purpose=None, chunk_size=CHUNK_SIZE, username=None):
+    cursors = _report_cursors(REPORT_SELECT, REPORT_BRANCH, USER_REPORT_BRANCH, start_date, end_date, purpose, username, REPORT_ORDER)
+    return _chunks(cursors, chunk_size)
+
+
+# Function to write the expense report as an Excel workbook into an open
+# binary file. progress, if given, is called with the number of rows written
+# after every chunk. Returns the number of rows written.
+def write_excel_report(report_file, start_date, end_date, purpose=None, progress=None, username=None):
+    import xlsxwriter
+
+    # constant_memory flushes each row to disk once the next row starts, so
+    # the workbook never holds more than one row in memory
+    workbook = xlsxwriter.Workbook(report_file, {"constant_memory": True})
+    worksheet = workbook.add_worksheet("Expenses")
+    worksheet.write_row(0, 0, REPORT_HEADERS)
+
+    row_count = 0
+    for rows in iter_report_rows(start_date, end_date, purpose, username=username):
+        for row in rows:
+            row_count += 1
+            worksheet.write_row(row_count, 0, row)
+        if progress:
+            progress(row_count)
+    workbook.close()
+    return row_count
+
+
+# Function to write the expense report as CSV into an open binary file; see
+# write_excel_report
+def write_csv_report(report_file, start_date, end_date, purpose=None, progress=None, username=None):
+    text = io.TextIOWrapper(report_file, encoding="utf-8", newline="")
+    writer = csv.writer(text)
+    writer.writerow(REPORT_HEADERS)
+
+    row_count = 0
+    for rows in iter_report_rows(start_date, end_date, purpose, username=username):
+        writer.writerows(rows)
+        row_count += len(rows)
+        if progress:
+            progress(row_count)
+    text.flush()
+    text.detach()
+    return row_count
+
+
+_font_metrics = None
+_font_lock = threading.Lock()
+
+
+# Function to load the report font's metrics from the pickle once per process
+def _load_font_metrics():
+    global _font_metrics
+    if _font_metrics is None:
+        with _font_lock:
+            if _font_metrics is None:
+                with open(FONT_METRICS_PATH, "rb") as metrics_file:
+                    _font_metrics = pickle.load(metrics_file)
+    return _font_metrics
+
+
+class _FontSubset(list):
+    """Characters used from an embedded font, ignoring repeats.
+
+    fpdf 1.7.2 appends every character of every cell to this list and then
+    checks each code point of the font against it, which takes minutes on a
+    long report when the list holds every repeat.
+    """
+
+    def __init__(self, chars):
+        super().__init__(chars)
+        self._seen = set(chars)
+
+    def append(self, char):
+        if char not in self._seen:
+            self._seen.add(char)
+            super().append(char)
+
+    def __contains__(self, char):
+        return char in self._seen
+
+
+# Function to register the report font on a document. This is what fpdf
+# 1.7.2's add_font(uni=True) does, minus reading the pickle for every document
+# and writing width caches next to the font.
+def _add_report_font(pdf):
+    metrics = _load_font_metrics()
+    pdf.fonts[REPORT_FONT] = {
+        "i": len(pdf.fonts) + 1, "type": metrics["type"], "name": metrics["name"],
+        "desc": metrics["desc"], "up": metrics["up"], "ut": metrics["ut"], "cw": metrics["cw"],
+        "ttffile": FONT_PATH, "fontkey": REPORT_FONT, "subset": _FontSubset(range(0, 32)),
+        "unifilename": None,
+    }
+    pdf.font_files[REPORT_FONT] = {"length1": metrics["originalsize"], "type": "TTF", "ttffile": FONT_PATH}
+    pdf.font_files[FONT_PATH] = {"type": "TTF"}
+
+
+class _FileBuffer:
+    """Stands in for FPDF.buffer, writing what is added to a binary file.
+
+    fpdf 1.7.2 only ever appends to its buffer and takes len() of it for the
+    object offsets of the cross-reference table, so counting the bytes
+    written keeps those offsets right.
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.size = 0
+
+    def __iadd__(self, text):
+        data = text.encode("latin-1")
+        self.file.write(data)
+        self.size += len(data)
+        return self
+
+    def __len__(self):
+        return self.size
+
+
+_streaming_pdf_class = None
+
+
+# Function to define, once fpdf is imported, the FPDF subclass used for reports
+def _streaming_pdf(report_file):
+    global _streaming_pdf_class
+    if _streaming_pdf_class is None:
+        from fpdf import FPDF
+
+        class StreamingPDF(FPDF):
+            """FPDF that writes each page to the file as soon as it ends.
+
+            fpdf 1.7.2 keeps every page until output() and then builds the
+            whole document as one string. Here a page's objects are written
+            when the next page starts, and close() only adds the fonts,
+            images and cross-reference table. Page number aliases and links
+            need the later pages and are not supported.
+            """
+
+            def __init__(self, report_file, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                self.buffer = _FileBuffer(report_file)
+                self.page_objects = []
+
+            def _putheader(self):
+                # Written before the first page, not again by _enddoc
+                if not len(self.buffer):
+                    super()._putheader()
+
+            def _endpage(self):
+                super()._endpage()
+                self._putheader()
+                # The page object and its content stream, as _putpages writes them
+                content = self.pages[self.page]
+                if self.compress:
+                    content = zlib.compress(content.encode("latin-1"))
+                self._newobj()
+                self.page_objects.append(self.n)
+                self._out("<</Type /Page")
+                self._out("/Parent 1 0 R")
+                if self.page in self.orientation_changes:
+                    self._out("/MediaBox [0 0 %.2f %.2f]" % (self.w_pt, self.h_pt))
+                self._out("/Resources 2 0 R")
+                if self.pdf_version > "1.3":
+                    self._out("/Group <</Type /Group /S /Transparency /CS /DeviceRGB>>")
+                self._out(f"/Contents {self.n + 1} 0 R>>")
+                self._out("endobj")
+                self._newobj()
+                self._out(("<</Filter /FlateDecode " if self.compress else "<<") + f"/Length {len(content)}>>")
+                self._putstream(content)
+                self._out("endobj")
+                self.pages[self.page] = ""
+
+            def _putpages(self):
+                # Only the page tree is left; the pages were written as they ended
+                w_pt, h_pt = (self.fw_pt, self.fh_pt) if self.def_orientation == "P" else (self.fh_pt, self.fw_pt)
+                self.offsets[1] = len(self.buffer)
+                self._out("1 0 obj")
+                self._out("<</Type /Pages")
+                self._out("/Kids [" + "".join(f"{n} 0 R " for n in self.page_objects) + "]")
+                self._out(f"/Count {len(self.page_objects)}")
+                self._out("/MediaBox [0 0 %.2f %.2f]" % (w_pt, h_pt))
+                self._out(">>")
+                self._out("endobj")
+
+        _streaming_pdf_class = StreamingPDF
+    return _streaming_pdf_class(report_file, format="A4")
+
+
+# Function to cut text down to what fits in a PDF cell
+def _fit(pdf, text, width):
+    text = " ".join(str(text or "").split())
+    if pdf.get_string_width(text) <= width - 2:
+        return text
+    while text and pdf.get_string_width(text + "...") > width - 2:
+        text = text[:-1]
+    return text + "..."
+
+
+# Function to stream the PDF report rows for a date range in chunks
+def iter_pdf_rows(start_date, end_date, purpose=None, chunk_size=CHUNK_SIZE, username=None):
+    cursors = _report_cursors(PDF_SELECT, PDF_BRANCH, USER_PDF_BRANCH, start_date, end_date, purpose, username, REPORT_ORDER)
+    return _chunks(cursors, chunk_size)
+
+
+# Function to place a bill's small thumbnail in the current PDF row. Each
+# thumbnail is embedded once, however many rows share the bill.
+def _pdf_thumbnail(pdf, conn, digest, image_dir, x, y):
+    name = os.path.join(image_dir, f"{digest}.jpg")
+    if name not in pdf.images:
+        row = conn.execute("SELECT data FROM bill_thumbnails WHERE hash = ? AND size = ?", (digest, THUMBNAIL_SMALL)).fetchone()
+        if not row:
+            return
+        with open(name, "wb") as image_file:
+            image_file.write(row[0])
+    pdf.image(name, x + 1, y + 1, h=PDF_BILL_ROW_HEIGHT - 2)
+
+
+# Function to write the expense report as a PDF with per-purpose subtotals
+# into an open binary file; see write_excel_report. Rows are read from the
+# database a chunk at a time and each page is written to the file as it
+# fills, so memory holds one page plus the fonts and thumbnails used.
+def write_pdf_report(report_file, start_date, end_date, purpose=None, progress=None, username=None, thumbnails=False):
+    pdf = _streaming_pdf(report_file)
+    pdf.set_auto_page_break(False)
+    _add_report_font(pdf)
+    widths = PDF_WIDTHS + ([PDF_BILL_WIDTH] if thumbnails else [])
+    headers = PDF_HEADERS + (["Bill"] if thumbnails else [])
+    row_height = PDF_BILL_ROW_HEIGHT if thumbnails else PDF_ROW_HEIGHT
+    title = f"Expense Report: {start_date} to {end_date}" + (f" ({purpose})" if purpose else "") + (f" for {username}" if username else "")
+
+    def new_page():
+        pdf.add_page()
+        pdf.set_font(REPORT_FONT, "", 12)
+        pdf.cell(0, 8, f"{title}, page {pdf.page_no()}", ln=1)
+        pdf.set_font(REPORT_FONT, "", 9)
+        pdf.set_fill_color(230, 230, 230)
+        for header, width in zip(headers, widths):
+            pdf.cell(width, PDF_ROW_HEIGHT, header, border=1, fill=True)
+        pdf.ln()
+
+    def ensure_room(height):
+        if pdf.get_y() + height > pdf.page_break_trigger:
+            new_page()
+
+    # Running (count, total) per purpose for the subtotals at the end
+    subtotals = {}
+    row_count = 0
+    conn = get_connection()
+    new_page()
+    with tempfile.TemporaryDirectory() as image_dir:
+        for rows in iter_pdf_rows(start_date, end_date, purpose, username=username):
+            for purchase_date, row_purpose, company_name, description, amount, digest in rows:
+                ensure_room(row_height)
+                x, y = pdf.get_x(), pdf.get_y()
+                pdf.cell(widths[0], row_height, str(purchase_date or "")[:10], border=1)
+                pdf.cell(widths[1], row_height, _fit(pdf, row_purpose, widths[1]), border=1)
+                pdf.cell(widths[2], row_height, _fit(pdf, company_name, widths[2]), border=1)
+                pdf.cell(widths[3], row_height, _fit(pdf, description, widths[3]), border=1)
+                pdf.cell(widths[4], row_height, f"₹{amount:,.2f}", border=1, align="R")
+                if thumbnails:
+                    pdf.cell(widths[5], row_height, "", border=1)
+                    if digest:
+                        _pdf_thumbnail(pdf, conn, digest, image_dir, x + sum(PDF_WIDTHS), y)
+                pdf.ln()
+
+                count, total = subtotals.get(row_purpose, (0, 0.0))
+                subtotals[row_purpose] = (count + 1, total + amount)
+                row_count += 1
+            if progress:
+                progress(row_count)
+
+    if row_count == 0:
+        return 0
+
+    # Subtotals by purpose, then the grand total
+    ensure_room(PDF_ROW_HEIGHT * (len(subtotals) + 3))
+    pdf.ln(4)
+    pdf.set_font(REPORT_FONT, "", 11)
+    pdf.cell(0, 8, "Subtotals by Purpose", ln=1)
+    pdf.set_font(REPORT_FONT, "", 9)
+    for row_purpose, (count, total) in sorted(subtotals.items()):
+        pdf.cell(60, PDF_ROW_HEIGHT, _fit(pdf, row_purpose, 60), border=1)
+        pdf.cell(30, PDF_ROW_HEIGHT, f"{count} expense(s)", border=1)
+        pdf.cell(40, PDF_ROW_HEIGHT, f"₹{total:,.2f}", border=1, align="R", ln=1)
+    pdf.cell(90, PDF_ROW_HEIGHT, f"Total ({row_count} expenses)", border=1, fill=True)
+    pdf.cell(40, PDF_ROW_HEIGHT, f"₹{sum(total for _, total in subtotals.values()):,.2f}", border=1, align="R", fill=True, ln=1)
+
+    pdf.close()
+    return row_count
+
+
+# Report formats by name: writer function, file extension and MIME type
+REPORT_FORMATS = {
+    "Excel": (write_excel_report, "xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "CSV": (write_csv_report, "csv", "text/csv"),
+    "PDF": (write_pdf_report, "pdf", "application/pdf"),
+    "PDF with bill thumbnails": (functools.partial(write_pdf_report, thumbnails=True), "pdf", "application/pdf"),
+}
+
+
+# Function to write a report into a temp file. Returns the rewound report
+# file, or None if there are no expenses.
+def _spooled_report(writer, start_date, end_date, purpose, username):
+    report_file = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    if writer(report_file, start_date, end_date, purpose, username=username) == 0:
+        report_file.close()
+        return None
+    report_file.seek(0)
+    return report_file
+
+
+# Function to write the expense report for a date range as an Excel workbook.
+# Returns the rewound report file, or None if there are no expenses.
+def download_expense_report_as_excel(start_date, end_date, purpose=None, username=None):
+    return _spooled_report(write_excel_report, start_date, end_date, purpose, username)
+
+
+# Function to write the expense report for a date range as CSV. Returns the
+# rewound report file, or None if there are no expenses.
+def download_expense_report_as_csv(start_date, end_date, purpose=None, username=None):
+    return _spooled_report(write_csv_report, start_date, end_date, purpose, username)
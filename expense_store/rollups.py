@@ -0,0 +1,80 @@
+# Totals derived from the expenses table: per-user, per-purpose, per-day
+# rollups and users.total_expense. Triggers created by migrations 4 and 5 in
+# db.py keep both current on every write; the functions here rebuild or check
+# them against the raw rows. Expenses moved to archive files (see archive.py)
+# are counted through archive_rollups, their frozen rollups, unless archived
+# is False, which the migrations that run before that table exists pass.
+
+# Day an expense is rolled up under: the calendar day of its recorded date
+ROLLUP_DAY = "IFNULL(substr(date, 1, 10), '')"
+
+# Largest difference between a rolled-up and a recomputed total that is
+# treated as floating point drift rather than a mismatch
+TOTAL_TOLERANCE = 0.005
+
+
+# Function to recompute every rollup row from the expenses table
+def rebuild_rollups(conn, archived=True):
+    conn.execute("DELETE FROM expense_rollups")
+    conn.execute(f'''
+        INSERT INTO expense_rollups (username, purpose, day, total, count)
+        SELECT username, purpose, {ROLLUP_DAY}, SUM(amount), COUNT(*)
+        FROM expenses
+        GROUP BY username, purpose, {ROLLUP_DAY}
+    ''')
+    if archived:
+        conn.execute('''
+            INSERT INTO expense_rollups (username, purpose, day, total, count)
+            SELECT username, purpose, day, total, count FROM archive_rollups WHERE true
+            ON CONFLICT (username, purpose, day) DO UPDATE
+            SET total = total + excluded.total, count = count + excluded.count
+        ''')
+
+
+# Function to compare the rollups with the expenses table. Returns a list of
+# (username, purpose, day, expected total, expected count, rolled-up total,
+# rolled-up count) for every group that differs.
+def verify_rollups(conn):
+    cursor = conn.execute(f'''
+        WITH actual AS (
+            SELECT username, purpose, day, SUM(total) AS total, SUM(count) AS count FROM (
+                SELECT username, purpose, {ROLLUP_DAY} AS day, SUM(amount) AS total, COUNT(*) AS count
+                FROM expenses
+                GROUP BY username, purpose, day
+                UNION ALL
+                SELECT username, purpose, day, total, count FROM archive_rollups
+            )
+            GROUP BY username, purpose, day
+        )
+        SELECT a.username, a.purpose, a.day, a.total, a.count, r.total, r.count
+        FROM actual a
+        LEFT JOIN expense_rollups r USING (username, purpose, day)
+        WHERE r.count IS NULL OR r.count != a.count OR abs(r.total - a.total) > ?
+        UNION ALL
+        SELECT r.username, r.purpose, r.day, NULL, NULL, r.total, r.count
+        FROM expense_rollups r
+        LEFT JOIN actual a USING (username, purpose, day)
+        WHERE a.count IS NULL
+    ''', (TOTAL_TOLERANCE,))
+    return cursor.fetchall()
+
+
+# Function to reset users.total_expense from the raw expenses wherever it has
+# drifted. Returns (username, stored total, correct total) for each fix.
+def reconcile_user_totals(conn, archived=True):
+    archived_totals = {}
+    if archived:
+        archived_totals = dict(conn.execute("SELECT username, SUM(total) FROM archive_rollups GROUP BY username"))
+    cursor = conn.execute('''
+        SELECT u.username, u.total_expense,
+               (SELECT IFNULL(SUM(e.amount), 0) FROM expenses e WHERE e.username = u.username)
+        FROM users u
+    ''')
+    fixes = []
+    for username, stored_total, hot_total in cursor.fetchall():
+        correct_total = hot_total + archived_totals.get(username, 0)
+        if stored_total is None or abs(stored_total - correct_total) > TOTAL_TOLERANCE:
+            fixes.append((username, stored_total, correct_total))
+    conn.executemany("UPDATE users SET total_expense = ? WHERE username = ?",
+                     [(correct_total, username) for username, _, correct_total in fixes])
+    return fixes
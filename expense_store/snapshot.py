@@ -0,0 +1,149 @@
+# Parquet snapshot of the expenses table for analytics, one file per
+# purchase month under year=YYYY/month=MM/. Triggers created by migrations 8
+# and 9 in db.py bump a month's version on every write to it, and the manifest records
+# the version each file was written at, so a new snapshot only rewrites the
+# months that changed since the last one.
+
+import json
+import os
+
+from .dates import day_number
+
+# Month an expense is snapshotted under: the YYYY-MM of its purchase day
+SNAPSHOT_MONTH = "IFNULL(strftime('%Y-%m', purchase_day * 86400, 'unixepoch'), '')"
+
+# Columns read for the snapshot; bill images stay in the database. The
+# integer dates are written out as the date and purchase_date columns.
+SNAPSHOT_COLUMNS = "id, date_ts, amount, purpose, description, purchase_day, company_name, contact_details, username, bill_hash"
+
+SNAPSHOT_NAMES = ["id", "date", "amount", "purpose", "description", "purchase_date", "company_name", "contact_details", "username", "bill_hash"]
+
+# One month of rows, as a branch run against the hot table and the archive
+# files for that month (see archive.py)
+MONTH_BRANCH = f"SELECT {SNAPSHOT_COLUMNS} FROM {{expenses}} WHERE purchase_day BETWEEN ? AND ?"
+MONTH_ORDER = "ORDER BY purchase_day, id"
+
+# Name of the file listing each month's path, row count and version
+MANIFEST_NAME = "_manifest.json"
+
+
+# Function to get the directory a month is written to, relative to the
+# snapshot root. Expenses without a purchase date go under unknown.
+def _month_path(month):
+    if not month:
+        return os.path.join("year=unknown", "month=unknown")
+    year, number = month.split("-")
+    return os.path.join(f"year={year}", f"month={number}")
+
+
+# Function to fetch the snapshot rows of one month. Expenses without a
+# purchase date are never archived.
+def _month_rows(conn, month):
+    # Imported here because archive.py needs db.py, which imports this module
+    from .archive import select_expenses
+
+    if not month:
+        cursor = conn.execute(f'''
+            SELECT {SNAPSHOT_COLUMNS} FROM expenses
+            WHERE purchase_day IS NULL
+            ORDER BY id
+        ''')
+        return cursor.fetchall()
+
+    year, number = (int(part) for part in month.split("-"))
+    next_month = f"{year + number // 12}-{number % 12 + 1:02d}-01"
+    cursors = select_expenses(conn, MONTH_BRANCH, day_number(f"{month}-01"), day_number(next_month) - 1,
+                              lambda first, last: (first, last), MONTH_ORDER)
+    return [row for cursor in cursors for row in cursor.fetchall()]
+
+
+# Function to turn rows into an Arrow table with typed columns. The integer
+# dates convert without parsing: epoch seconds to timestamps, day numbers to
+# date32, which counts days from the same epoch. Purpose is dictionary encoded.
+def _to_table(rows):
+    import pyarrow as pa
+
+    columns = dict(zip(SNAPSHOT_NAMES, zip(*rows)))
+    return pa.table({
+        "id": pa.array(columns["id"], pa.int64()),
+        "date": pa.array(columns["date"], pa.int64()).cast(pa.timestamp("s", tz="Asia/Kolkata")),
+        "amount": pa.array(columns["amount"], pa.float64()),
+        "purpose": pa.array(columns["purpose"], pa.string()).dictionary_encode(),
+        "description": pa.array(columns["description"], pa.string()),
+        "purchase_date": pa.array(columns["purchase_date"], pa.int32()).cast(pa.date32()),
+        "company_name": pa.array(columns["company_name"], pa.string()),
+        "contact_details": pa.array(columns["contact_details"], pa.string()),
+        "username": pa.array(columns["username"], pa.string()),
+        "bill_hash": pa.array(columns["bill_hash"], pa.string()),
+    })
+
+
+# Function to read the manifest of an existing snapshot, or an empty one
+def read_manifest(directory):
+    try:
+        with open(os.path.join(directory, MANIFEST_NAME), encoding="utf-8") as manifest_file:
+            return json.load(manifest_file)
+    except FileNotFoundError:
+        return {"months": {}}
+
+
+# Function to write the manifest, replacing the old one in a single rename
+def _write_manifest(directory, manifest):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, MANIFEST_NAME)
+    with open(path + ".tmp", "w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+# Function to bring the Parquet snapshot in directory up to date. Months whose
+# version is unchanged since the last snapshot are left alone; changed months
+# are rewritten and emptied months removed. Returns counts of each.
+def export_snapshot(conn, directory):
+    import pyarrow.parquet as pq
+
+    manifest = read_manifest(directory)
+    previous = manifest["months"]
+
+    # Versions are read before the rows, so a write that lands in between is
+    # at worst exported again next time, never skipped
+    versions = dict(conn.execute("SELECT month, version FROM snapshot_versions"))
+
+    result = {"written": 0, "reused": 0, "removed": 0, "rows": 0}
+    months = {}
+    for month, version in sorted(versions.items()):
+        path = _month_path(month)
+        entry = previous.get(month)
+        if entry and entry["version"] == version and os.path.exists(os.path.join(directory, entry["path"], "part.parquet")):
+            months[month] = entry
+            result["reused"] += 1
+            continue
+
+        rows = _month_rows(conn, month)
+        if not rows:
+            continue
+        # Written beside the old file and renamed over it, so readers never
+        # see a partly written month
+        file_path = os.path.join(directory, path, "part.parquet")
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        pq.write_table(_to_table(rows), file_path + ".tmp")
+        os.replace(file_path + ".tmp", file_path)
+        months[month] = {"path": path, "version": version, "rows": len(rows)}
+        result["written"] += 1
+        result["rows"] += len(rows)
+
+    # Drop the files of months that no longer have any expenses
+    for month, entry in previous.items():
+        if month not in months:
+            month_dir = os.path.join(directory, entry["path"])
+            try:
+                os.remove(os.path.join(month_dir, "part.parquet"))
+                # Also removes year directories left empty; the manifest keeps
+                # the snapshot root itself from being removed
+                os.removedirs(month_dir)
+            except OSError:
+                pass
+            result["removed"] += 1
+
+    _write_manifest(directory, {"columns": SNAPSHOT_NAMES, "months": months})
+    return result
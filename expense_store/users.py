@@ -0,0 +1,137 @@
+import hashlib
+import json
+
+from .db import get_connection
+from .cache import cached_read, invalidates
+from .bills import release_bills
+from .archive import purge_archived_users
+
+# Users listed per page on the Manage Users page
+USERS_PAGE_SIZE = 50
+
+
+# Function to hash a password the way it is stored in the users table
+def hash_password(password):
+    return hashlib.sha256(password.encode()).hexdigest()
+
+
+# Function to list users with their total expense. total_expense is kept
+# current by triggers on the expenses table, so no join is needed.
+@cached_read
+def get_users():
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT username, name, role, contact_details, total_expense FROM users")
+    users = cursor.fetchall()
+    return users
+
+
+# Function to turn filter text into a LIKE pattern that matches it anywhere,
+# with the LIKE wildcards in the text taken literally
+def _like_pattern(text):
+    if not text:
+        return None
+    return "%" + text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+# Function to retrieve one page of users ordered by username, optionally
+# limited to one role and to usernames or names containing the text. Returns
+# the page and the cursor to pass as after for the next page (None on the
+# last page).
+@cached_read
+def get_users_page(text=None, role=None, after=None, limit=USERS_PAGE_SIZE):
+    pattern = _like_pattern(text)
+    conn = get_connection()
+    # A role gets its own statement so it is read through the
+    # (role, username) index instead of filtering every user
+    if role is None:
+        cursor = conn.execute('''
+            SELECT username, name, role, contact_details, total_expense, active FROM users
+            WHERE username > ?
+            AND (? IS NULL OR username LIKE ? ESCAPE '\\' OR name LIKE ? ESCAPE '\\')
+            ORDER BY username
+            LIMIT ?
+        ''', (after or "", pattern, pattern, pattern, limit + 1))
+    else:
+        cursor = conn.execute('''
+            SELECT username, name, role, contact_details, total_expense, active FROM users
+            WHERE role = ? AND username > ?
+            AND (? IS NULL OR username LIKE ? ESCAPE '\\' OR name LIKE ? ESCAPE '\\')
+            ORDER BY username
+            LIMIT ?
+        ''', (role, after or "", pattern, pattern, pattern, limit + 1))
+    users = cursor.fetchall()
+    if len(users) > limit:
+        return users[:limit], users[limit - 1][0]
+    return users, None
+
+
+# Function to delete users together with their expenses, hot and archived,
+# and the bills no remaining expense refers to. Archived rows are purged
+# first (see archive.purge_archived_users); the rest happens in one
+# transaction. Returns the number of users, expenses and bills removed.
+@invalidates
+def delete_users(usernames):
+    names = json.dumps(list(usernames))
+    conn = get_connection()
+    archived_count, archived_digests = purge_archived_users(conn, usernames)
+    with conn:
+        digests = [row[0] for row in conn.execute('''
+            SELECT DISTINCT bill_hash FROM expenses
+            WHERE username IN (SELECT value FROM json_each(?)) AND bill_hash IS NOT NULL
+        ''', (names,))]
+        expense_count = conn.execute("DELETE FROM expenses WHERE username IN (SELECT value FROM json_each(?))", (names,)).rowcount
+        user_count = conn.execute("DELETE FROM users WHERE username IN (SELECT value FROM json_each(?))", (names,)).rowcount
+
+        # The delete triggers took the hot rows out of the rollups; what is
+        # left of these users' rollups is their archived totals
+        conn.execute("DELETE FROM archive_rollups WHERE username IN (SELECT value FROM json_each(?))", (names,))
+        conn.execute("DELETE FROM expense_rollups WHERE username IN (SELECT value FROM json_each(?))", (names,))
+        conn.execute("DELETE FROM archived_bills WHERE hash IN (SELECT value FROM json_each(?))", (json.dumps(archived_digests),))
+        bill_count = release_bills(conn, digests + archived_digests)
+    return user_count, expense_count + archived_count, bill_count
+
+
+# Function to delete a user with their expenses; see delete_users
+def delete_user(username):
+    return delete_users([username])
+
+
+# Function to activate or deactivate users; inactive users cannot log in but
+# keep their expenses. Returns the number of users changed.
+@invalidates
+def set_users_active(usernames, active):
+    conn = get_connection()
+    with conn:
+        cursor = conn.execute("UPDATE users SET active = ? WHERE username IN (SELECT value FROM json_each(?))",
+                              (1 if active else 0, json.dumps(list(usernames))))
+    return cursor.rowcount
+
+
+# Function to authenticate user
+def authenticate_user(username, password):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT role FROM users WHERE username = ? AND password = ? AND active = 1", (username, hash_password(password)))
+    result = cursor.fetchone()
+    if result:
+        return result[0]  # return role ('admin' or 'user')
+    return None  # invalid username/password
+
+
+# Function to check whether a username is already taken
+@cached_read
+def user_exists(username):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*) FROM users WHERE username = ?", (username,))
+    return cursor.fetchone()[0] > 0
+
+
+# Function to register a new user
+@invalidates
+def register_user(username, password, role, name, contact_details):
+    conn = get_connection()
+    with conn:
+        conn.execute("INSERT INTO users (username, password, role, name, contact_details) VALUES (?, ?, ?, ?, ?)",
+                     (username, hash_password(password), role, name, contact_details))
@@ -0,0 +1,210 @@
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+from .db import get_connection
+from .cache import bump_data_version
+from .profiling import _percentile
+
+# Writes queued while a batch commits are applied together in the next one,
+# up to this many per transaction
+WRITE_BATCH_MAX = int(os.environ.get("EXPENSE_WRITE_BATCH_MAX", "64"))
+
+# How long, in milliseconds, the writer waits for more writes after the first
+# of a batch arrives; 0 only batches the writes that queued up on their own
+WRITE_BATCH_WAIT_MS = float(os.environ.get("EXPENSE_WRITE_BATCH_WAIT_MS", "0"))
+
+# busy_timeout of the writer's connection, for when another process (a
+# manage.py command, say) holds the write lock, and how many times a batch
+# that still finds the database locked is retried, with doubling delays
+WRITE_BUSY_TIMEOUT_MS = int(os.environ.get("EXPENSE_WRITE_BUSY_TIMEOUT_MS", "10000"))
+WRITE_RETRIES = int(os.environ.get("EXPENSE_WRITE_RETRIES", "3"))
+WRITE_RETRY_DELAY = 0.05
+
+# Batches and writes kept for the latency percentiles
+WRITE_SAMPLES = 500
+
+# How long, in seconds, a page waits on a write's Future before reporting it
+# as not saved
+WRITE_TIMEOUT_SECONDS = float(os.environ.get("EXPENSE_WRITE_TIMEOUT_SECONDS", "30"))
+
+logger = logging.getLogger("expense_store.writer")
+
+
+# Function to tell whether an error means the database was locked by another
+# connection, which retrying can get past
+def _is_busy(error):
+    return isinstance(error, sqlite3.OperationalError) and ("locked" in str(error) or "busy" in str(error))
+
+
+class WriteQueue:
+    """Applies every write of the process on one thread, in batches.
+
+    A write is a function called as func(conn, *args) on the writer's
+    connection; it must not commit. Each batch is one transaction, so a burst
+    of writes shares one commit instead of each waiting for the write lock,
+    and each write runs under its own savepoint, so one that fails is rolled
+    back alone. Callers get a Future with the function's result.
+    """
+
+    def __init__(self, batch_max, batch_wait, busy_timeout_ms, retries):
+        self.batch_max = batch_max
+        self.batch_wait = batch_wait
+        self.busy_timeout_ms = busy_timeout_ms
+        self.retries = retries
+        self.writes = 0
+        self.failed = 0
+        self.batches = 0
+        self.retried = 0
+        self.max_depth = 0
+        self._commit_seconds = deque(maxlen=WRITE_SAMPLES)
+        self._latency_seconds = deque(maxlen=WRITE_SAMPLES)
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="expense-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, func, *args):
+        future = Future()
+        self._queue.put((func, args, future, time.perf_counter()))
+        depth = self._queue.qsize()
+        with self._lock:
+            self.max_depth = max(self.max_depth, depth)
+        return future
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.batch_wait
+        while len(batch) < self.batch_max:
+            try:
+                timeout = deadline - time.perf_counter()
+                batch.append(self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        try:
+            conn = get_connection()
+            conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        except Exception as error:
+            # Without a connection every write fails with the reason, rather
+            # than the thread dying and leaving the callers waiting
+            logger.exception("The writer could not open its connection")
+            while True:
+                self._fail(self._next_batch(), error)
+        while True:
+            batch = [request for request in self._next_batch() if request[2].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                self._apply(conn, batch)
+            except Exception as error:
+                logger.exception("The writer failed outside a write")
+                self._fail(batch, error)
+
+    def _fail(self, batch, error):
+        futures = [future for _, _, future, _ in batch if not future.done()]
+        with self._lock:
+            self.writes += len(futures)
+            self.failed += len(futures)
+        for future in futures:
+            future.set_exception(error)
+
+    def _apply(self, conn, batch):
+        for attempt in range(self.retries + 1):
+            started = time.perf_counter()
+            try:
+                outcomes = self._transaction(conn, batch)
+                break
+            except Exception as error:
+                if conn.in_transaction:
+                    conn.rollback()
+                if _is_busy(error) and attempt < self.retries:
+                    with self._lock:
+                        self.retried += 1
+                    time.sleep(WRITE_RETRY_DELAY * 2 ** attempt)
+                    continue
+                outcomes = [(future, None, error) for _, _, future, _ in batch]
+                break
+        finished = time.perf_counter()
+
+        # Reads cached before the commit are stale once the callers hear back
+        bump_data_version()
+        with self._lock:
+            self.batches += 1
+            self._commit_seconds.append(finished - started)
+            for _, _, _, submitted in batch:
+                self._latency_seconds.append(finished - submitted)
+            for future, _, error in outcomes:
+                self.writes += 1
+                if error is not None:
+                    self.failed += 1
+        for future, result, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def _transaction(self, conn, batch):
+        outcomes = []
+        conn.execute("BEGIN IMMEDIATE")
+        for func, args, future, _ in batch:
+            conn.execute("SAVEPOINT write_request")
+            try:
+                outcomes.append((future, func(conn, *args), None))
+            except Exception as error:
+                # A locked database fails the whole batch, which is retried
+                if _is_busy(error):
+                    raise
+                conn.execute("ROLLBACK TO write_request")
+                outcomes.append((future, None, error))
+            conn.execute("RELEASE write_request")
+        conn.commit()
+        return outcomes
+
+    def stats(self):
+        with self._lock:
+            commits = sorted(self._commit_seconds)
+            latencies = sorted(self._latency_seconds)
+            return {
+                "depth": self._queue.qsize(),
+                "max_depth": self.max_depth,
+                "writes": self.writes,
+                "failed": self.failed,
+                "batches": self.batches,
+                "retried": self.retried,
+                "writes_per_batch": self.writes / self.batches if self.batches else 0.0,
+                "commit_p50_ms": _percentile(commits, 50) * 1000 if commits else 0.0,
+                "commit_p95_ms": _percentile(commits, 95) * 1000 if commits else 0.0,
+                "latency_p95_ms": _percentile(latencies, 95) * 1000 if latencies else 0.0,
+            }
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_write_queue():
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = WriteQueue(WRITE_BATCH_MAX, WRITE_BATCH_WAIT_MS / 1000, WRITE_BUSY_TIMEOUT_MS, WRITE_RETRIES)
+    return _writer
+
+
+# Function to queue a write, called as func(conn, *args) on the writer
+# thread, and return a Future with its result
+def submit_write(func, *args):
+    return get_write_queue().submit(func, *args)
+
+
+# Function to report queue depth, batch sizes and commit latency
+def writer_stats():
+    return get_write_queue().stats()
@@ -1,258 +1,36 @@
-import sqlite3
 import streamlit as st
-import pandas as pd
-import hashlib
-from datetime import datetime
-import plotly.express as px
-import pytz
-import io
+from concurrent.futures import TimeoutError as WriteTimeout
+from datetime import date, datetime
 from io import BytesIO
 
-# Function to create the SQLite database and tables for expenses and users
-def create_tables():
-    # Open the database connection
-    conn = sqlite3.connect("database.db")
-    cursor = conn.cursor()
-
-    # Create the expenses table if it doesn't exist
-    cursor.execute(''' 
-        CREATE TABLE IF NOT EXISTS expenses (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            amount REAL NOT NULL,
-            purpose TEXT NOT NULL,
-            description TEXT,
-            bill_image BLOB,
-            purchase_date DATE,
-            company_name TEXT,
-            contact_details TEXT,
-            username TEXT NOT NULL,  -- Added column for user association
-            FOREIGN KEY (username) REFERENCES users(username)  -- Adding foreign key constraint
-        )
-    ''')
-
-    # Create the users table if it doesn't exist
-    cursor.execute(''' 
-        CREATE TABLE IF NOT EXISTS users (
-            username TEXT PRIMARY KEY,
-            password TEXT NOT NULL,
-            role TEXT NOT NULL,
-            name TEXT,
-            contact_details TEXT,
-            total_expense REAL DEFAULT 0.0
-        )
-    ''')
-
-    # Add admin user if not exists (username: radha, password: kalki)
-    cursor.execute("SELECT COUNT(*) FROM users WHERE username = 'radha'")
-    if cursor.fetchone()[0] == 0:
-        # Hash the default password
-        hashed_password = hashlib.sha256("kalki".encode()).hexdigest()
-
-        # Insert the default admin user with name, contact_details, and role
-        cursor.execute("INSERT INTO users (username, password, role, name, contact_details) VALUES (?, ?, ?, ?, ?)", 
-                       ("radha", hashed_password, "admin", "Kalki", "9511506378"))
-        
-        # Commit the transaction
-        conn.commit()
-
-    # Close the connection
-    conn.close()
-
-def get_users():
-    # Open a database connection
-    conn = sqlite3.connect("database.db")
-    cursor = conn.cursor()
-    
-    # Fetch users along with their total expense
-    cursor.execute(''' 
-        SELECT u.username, u.name, u.role, u.contact_details, 
-               IFNULL(SUM(e.amount), 0) AS total_expense
-        FROM users u
-        LEFT JOIN expenses e ON u.username = e.username
-        GROUP BY u.username
-    ''')
-    
-    users = cursor.fetchall()
-    
-    # Close the connection
-    conn.close()
-    
-    return users
-
-def get_users():
-    conn = sqlite3.connect("database.db")
-    cursor = conn.cursor()
-    cursor.execute("SELECT username, name, role, contact_details, total_expense FROM users")
-    users = cursor.fetchall()
-    conn.close()
-    return users
-
-
-def delete_user(username):
-    # Open a database connection
-    conn = sqlite3.connect("database.db")
-    cursor = conn.cursor()
-    
-    # Delete the user from the users table
-    cursor.execute("DELETE FROM users WHERE username = ?", (username,))
-    conn.commit()
-
-    # Close the connection
-    conn.close()
-# Function to authenticate user
-def authenticate_user(username, password):
-    conn = sqlite3.connect("database.db")
-    cursor = conn.cursor()
-    hashed_password = hashlib.sha256(password.encode()).hexdigest()
-    cursor.execute("SELECT role FROM users WHERE username = ? AND password = ?", (username, hashed_password))
-    result = cursor.fetchone()
-    conn.close()
-    if result:
-        return result[0]  # return role ('admin' or 'user')
-    return None  # invalid username/password
-
-def delete_expense(expense_id):
-    conn = sqlite3.connect("database.db")
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM expenses WHERE ID = ?", (expense_id,))
-    conn.commit()
-    conn.close()
-
-def get_expenses_by_purpose_and_date_range(purpose, start_date, end_date):
-    conn = sqlite3.connect("database.db")
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT * FROM expenses
-        WHERE purchase_date BETWEEN ? AND ?
-        AND purpose = ?
-    ''', (start_date, end_date, purpose))
-    records = cursor.fetchall()
-    conn.close()
-    return records
-
-# Function to register a new user
-def register_user(username, password, role, name, contact_details):
-    conn = sqlite3.connect("database.db")
-    cursor = conn.cursor()
-    hashed_password = hashlib.sha256(password.encode()).hexdigest()
-    cursor.execute("INSERT INTO users (username, password, role, name, contact_details) VALUES (?, ?, ?, ?, ?)", 
-                   (username, hashed_password, role, name, contact_details))
-    conn.commit()
-    conn.close()
-
-
-# Function to insert a new expense record into the database
-def insert_expense(amount, purpose, description, purchase_date, bill_image, company_name, contact_details):
-    # Get the username of the logged-in user from session state
-    username = st.session_state.get("username")
-
-    # If the username is not available, raise an error
-    if not username:
-        st.error("You must be logged in to add an expense.")
-        return
-
-    # Open a database connection
-    conn = sqlite3.connect("database.db")
-    cursor = conn.cursor()
-
-    # Get the current time in India timezone
-    india_timezone = pytz.timezone('Asia/Kolkata')
-    current_time = datetime.now(india_timezone).strftime("%Y-%m-%d %H:%M:%S")
-
-    # Insert the expense details, including the username from the session
-    cursor.execute(''' 
-        INSERT INTO expenses (date, amount, purpose, description, purchase_date, bill_image, company_name, contact_details, username) 
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (current_time, amount, purpose, description, purchase_date, bill_image, company_name, contact_details, username))
-
-    # Commit the transaction and close the connection
-    conn.commit()
-    conn.close()
-    st.success("Expense added successfully!")
-
-# Function to retrieve all expenses
-def get_expenses():
-    conn = sqlite3.connect("database.db")
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM expenses")
-    records = cursor.fetchall()
-    conn.close()
-    return records
-
-# Function to retrieve the last 5 expenses
-def get_recent_expenses():
-    conn = sqlite3.connect("database.db")
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM expenses ORDER BY date DESC LIMIT 5")
-    records = cursor.fetchall()
-    conn.close()
-    return records
-
-def update_expense(expense_id, amount, purpose, description, purchase_date, bill_image, company_name, contact_details):
-    conn = sqlite3.connect("database.db")
-    cursor = conn.cursor()
-    cursor.execute('''
-        UPDATE expenses 
-        SET amount = ?, purpose = ?, description = ?, purchase_date = ?, bill_image = ?, company_name = ?, contact_details = ? 
-        WHERE id = ? 
-    ''', (amount, purpose, description, purchase_date, bill_image, company_name, contact_details, expense_id))
-    conn.commit()
-    conn.close()
-
-# Function to retrieve expenses within the given date range
-def get_expenses_by_date_range(start_date, end_date):
-    conn = sqlite3.connect("database.db")
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM expenses WHERE purchase_date BETWEEN ? AND ?", (start_date, end_date))
-    records = cursor.fetchall()
-    conn.close()
-    return records
-
-def delete_expense(expense_id):
-    conn = sqlite3.connect("database.db")
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM expenses WHERE id = ?", (expense_id,))
-    conn.commit()
-    conn.close()
-
-
-def download_expense_report_as_excel(expenses):
-    # Check if expenses are passed correctly
-    # print(f"Expenses passed to the function: {expenses}")
-
-    # Check if there are any records
-    if not expenses:
-        print("No expenses found.")
-        return None  # Return None if no expenses are available
-
-    # Convert the expenses data to a pandas DataFrame
-    df = pd.DataFrame(data=expenses, columns=["ID", "Date", "Amount", "Purpose", "Description", "Bill Image", "Purchase Date", "Company Name", "Contact Details"])
-
-    # Check if DataFrame is populated correctly
-    # print(f"DataFrame before date conversion: {df.head()}")
-
-    # Convert 'Purchase Date' to datetime (handling any invalid or missing dates)
-    # df["Purchase Date"] = pd.to_datetime(df["Purchase Date"], errors='coerce', dayfirst=True)
-
-    # # Check after conversion
-    # print(f"DataFrame after date conversion: {df.head()}")
-
-    # # Handle any NaT (Not a Time) values in 'Purchase Date'
-    # df = df.dropna(subset=["Purchase Date"])
-
-    # # Remove the "Bill" column if you don't want to include the binary data (images)
-    df = df.drop(["Bill Image"], axis=1)
-
-    # Save the DataFrame to an Excel file in-memory using openpyxl engine
-    excel_file = io.BytesIO()
-    with pd.ExcelWriter(excel_file, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False)
-
-    # Rewind the buffer to the beginning before downloading
-    excel_file.seek(0)
-
-    return excel_file
+# pandas and plotly are imported on the pages that use them, so the login
+# screen and the data layer don't pay for them on every cold start
+from expense_store import (
+    create_tables, pool_stats, cache_stats, query_profile, slow_queries, reset_query_profile,
+    get_users_page, authenticate_user, user_exists, register_user, delete_users, set_users_active,
+    get_expense, get_expense_frame, frame_page, frame_row, get_recent_expenses, get_expenses_by_date_range,
+    get_expenses_by_purpose_and_date_range, search_expenses, insert_expense, update_expense, delete_expense,
+    day_date, get_bill, get_thumbnail, THUMBNAIL_SMALL, THUMBNAIL_PREVIEW,
+    get_expense_summary, get_totals_by_purpose, get_monthly_totals,
+    REPORT_FORMATS, submit_report, get_report_job, cancel_report_job, report_queue_stats, writer_stats, WRITE_TIMEOUT_SECONDS, analytics_engine, archived_years,
+    PURPOSES, IMPORT_CHUNK_SIZE, ExpenseImportError, import_expenses,
+)
+
+# Function to show an expense's bill as a thumbnail; the original is only
+# loaded when the user asks for it
+def show_bill(bill_hash, key, size=THUMBNAIL_SMALL):
+    thumbnail = get_thumbnail(bill_hash, size)
+    if thumbnail:
+        st.image(BytesIO(thumbnail), caption="Bill Image")
+        if st.checkbox("Show original bill", key=key):
+            st.image(BytesIO(get_bill(bill_hash)), caption="Original Bill")
+    # Bills without a preview, such as PDFs, are offered as a download
+    elif st.checkbox("Load bill", key=key):
+        st.download_button("Download Bill", data=get_bill(bill_hash), file_name=f"bill_{bill_hash[:12]}", key=f"{key}_download")
+
+
+# Initialize tables (runs once per process)
+create_tables()
 
 # Streamlit UI Setup
 st.set_page_config(page_title="SIN Technologies", layout="wide")
@@ -314,11 +92,35 @@ with st.sidebar:
         
         # Show different pages based on user role
         if user_role == "admin":
-            page = st.selectbox("Navigate to", ["Home", "Add Expense", "Search Expenses", "Modify Expense", "Download Reports", "Delete Expense" , "Manage Users"])
+            page = st.selectbox("Navigate to", ["Home", "Add Expense", "Search Expenses", "Modify Expense", "Download Reports", "Delete Expense" , "Manage Users", "Import Expenses", "Query Profile"])
         else:
             page = st.selectbox("Navigate to", ["Home", "Add Expense", "Search Expenses", "Download Reports"])
+
+        # Employees and Developers only see their own expenses; an admin sees
+        # everyone's or picks one user. None means every user.
+        if user_role == "admin":
+            # A name checked against the users table, rather than a list of
+            # every user, which would read the whole table on every rerun
+            scope_choice = st.text_input("Show expenses of", placeholder="All users (or type a username)").strip()
+            scope = scope_choice or None
+            if scope and not user_exists(scope):
+                st.warning(f"No user named {scope}; showing all users.")
+                scope = None
+        else:
+            scope = st.session_state.username
         
         st.markdown("---")
+
+        if user_role == "admin":
+            stats = pool_stats()
+            st.caption(f"DB pool: {stats['hits']} hits, {stats['misses']} misses, {stats['idle']} idle")
+            stats = cache_stats()
+            st.caption(f"Read cache: {stats['hit_rate']:.0%} hit rate, {stats['entries']} entries, data version {stats['version']}")
+            stats = report_queue_stats()
+            st.caption(f"Reports ({analytics_engine()}): {stats['queued']} queued, {stats['running']} running, {stats['cached']} cached")
+            stats = writer_stats()
+            st.caption(f"Writes: {stats['depth']} queued, {stats['writes_per_batch']:.1f} per commit, "
+                       f"commit p95 {stats['commit_p95_ms']:.1f} ms, {stats['retried']} retries")
         
         if st.button("Logout"):
             st.session_state.logged_in = False
@@ -358,15 +160,11 @@ elif page == "Register":
 
     if register_button:
         # Check if username already exists
-        conn = sqlite3.connect("database.db")
-        cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM users WHERE username = ?", (new_username,))
-        if cursor.fetchone()[0] > 0:
+        if user_exists(new_username):
             st.error("Username already exists. Please choose a different username.")
         else:
             register_user(new_username, new_password, role, new_name, new_contact_details)
             st.success("User registered successfully!")
-        conn.close()
 
 # Handle Home Page (only accessible after login)
 elif page == "Home" and st.session_state.get("logged_in", False):
@@ -374,31 +172,30 @@ elif page == "Home" and st.session_state.get("logged_in", False):
     
     col1, col2, col3 = st.columns(3)
 
+    # Totals are aggregated in SQLite, so only the summary row is fetched
+    total_expense, total_count, average_expense = get_expense_summary(scope)
+
     # Total Expense Visualization
     with col1:
-        expenses = get_expenses()
-        total_expense = sum([expense[2] for expense in expenses])
         st.metric("Total Expenses (INR)", f"₹{total_expense:.2f}")
 
     # Expense Count Visualization
     with col2:
-        total_count = len(expenses)
         st.metric("Total Expense Records", total_count)
     
     # Average Expense Visualization
     with col3:
-        average_expense = total_expense / total_count if total_count > 0 else 0
         st.metric("Average Expense (INR)", f"₹{average_expense:.2f}")
 
     # Visualizations (Plotting)
     st.subheader("Expense Breakdown")
 
-    # Create DataFrame for expenses
-    expense_df = pd.DataFrame(expenses, columns=["ID", "Date", "Amount", "Purpose","Description", "Bill Image", "Purchase Date", "Company Name", "Contact Details", "username"])
-    
+    import pandas as pd
+    import plotly.express as px
+
     # Plot total expenses by purpose using Plotly
     st.subheader("Total Expenses by Purpose")
-    expense_purpose = expense_df.groupby("Purpose")["Amount"].sum().reset_index()
+    expense_purpose = pd.DataFrame(get_totals_by_purpose(scope), columns=["Purpose", "Amount"])
     fig = px.bar(expense_purpose, x="Purpose", y="Amount", title="Total Expenses by Purpose", 
                  labels={"Purpose": "Expense Purpose", "Amount": "Total Amount (INR)"}, 
                  color="Amount", color_continuous_scale="Viridis")
@@ -406,13 +203,9 @@ elif page == "Home" and st.session_state.get("logged_in", False):
 
     # Plot expense distribution over time using Plotly
     st.subheader("Monthly Expense Trend")
-    expense_df["Date"] = pd.to_datetime(expense_df["Date"])
 
-    # Group by month (use the period 'M' to group by month) and sum only the 'Amount' column
-    monthly_expenses = expense_df.groupby(expense_df["Date"].dt.to_period("M"))["Amount"].sum().reset_index()
-    
-    # Convert the 'Date' column back to the timestamp for plotting
-    monthly_expenses["Date"] = monthly_expenses["Date"].dt.to_timestamp()
+    # One row per month, keyed by the date of the first day of the month
+    monthly_expenses = pd.DataFrame(get_monthly_totals(scope), columns=["Date", "Amount"])
 
     fig2 = px.line(monthly_expenses, x="Date", y="Amount", title="Monthly Expense Trend",
                    labels={"Date": "Month", "Amount": "Total Amount (INR)"}, markers=True)
@@ -420,7 +213,7 @@ elif page == "Home" and st.session_state.get("logged_in", False):
 
     # Display recent expenses
     st.subheader("Recent Expenses")
-    recent_expenses = get_recent_expenses()
+    recent_expenses = get_recent_expenses(scope)
     for expense in recent_expenses:
         with st.expander(f"Expense ID: {expense[0]}, Amount: ₹{expense[2]:.2f}"):
             st.write("### Expense Details")
@@ -432,7 +225,7 @@ elif page == "Home" and st.session_state.get("logged_in", False):
             st.write(f"**Company Name:** {expense[7]}")
             st.write(f"**Contact Details:** {expense[8]}")
             if expense[5]:
-                st.image(BytesIO(expense[5]), caption="Bill Image")
+                show_bill(expense[5], key=f"recent_bill_{expense[0]}")
 
 # Handle Add Expense Page (only accessible after login)
 elif page == "Add Expense" and st.session_state.get("logged_in", False):
@@ -440,7 +233,7 @@ elif page == "Add Expense" and st.session_state.get("logged_in", False):
     
     with st.form("expense_form", clear_on_submit=True):
         amount = st.number_input("Expense Amount (INR)", min_value=0.01, step=0.01, format="%.2f")
-        purpose = st.selectbox("Purpose of Purchase", ["Books", "Electronics", "Event", "Marketing", "Operations", "Travel", "Miscellaneous"])
+        purpose = st.selectbox("Purpose of Purchase", PURPOSES)
         description = st.text_area("Description", max_chars=500)
         purchase_date = st.date_input("Date of Purchase")
         company_name = st.text_input("Company Name")
@@ -459,33 +252,77 @@ elif page == "Add Expense" and st.session_state.get("logged_in", False):
             # Read the image file if uploaded
             bill_image_bytes = bill_image.read() if bill_image else None
 
-            # Insert the expense into the database
-            insert_expense(amount, purpose, description, purchase_date, bill_image_bytes, company_name, contact_details)
-            st.success("Expense added successfully!")
+            # Insert the expense into the database and wait for the writer to commit it
+            try:
+                insert_expense(st.session_state.username, amount, purpose, description, purchase_date, bill_image_bytes, company_name, contact_details).result(timeout=WRITE_TIMEOUT_SECONDS)
+                st.success("Expense added successfully!")
+            except WriteTimeout:
+                st.error(f"The expense was not saved within {WRITE_TIMEOUT_SECONDS:g} seconds. It may still be saved, "
+                         "so check Search Expenses before trying again.")
+            except Exception as e:
+                st.error(f"The expense could not be saved: {e}")
 # Handle Search Expenses Page (only accessible after login)
 elif page == "Search Expenses" and st.session_state.get("logged_in", False):
     st.header("Search Expenses")
 
     with st.form("search_form"):
-        purpose = st.selectbox("Purpose", ["All", "Books", "Electronics", "Event", "Marketing", "Operations", "Travel", "Miscellaneous"])
+        text = st.text_input("Text", placeholder="Words from the description, company name or contact details")
+        purpose = st.selectbox("Purpose", ["All"] + PURPOSES)
         start_date = st.date_input("Start Date", value=datetime(2020, 1, 1))
         end_date = st.date_input("End Date", value=datetime.now().date())
         search_button = st.form_submit_button("Search")
 
     if search_button:
-        # Modify the function to handle purpose filtering
-        if purpose == "All":
-            expenses = get_expenses_by_date_range(start_date, end_date)
+        # Remember the criteria across reruns and start from the first page
+        st.session_state.search = {"text": text.strip(), "purpose": purpose, "start_date": start_date, "end_date": end_date, "scope": scope}
+        st.session_state.search_cursors = [None]
+
+    search = st.session_state.get("search")
+    if search and search.get("scope", scope) != scope:
+        # The admin switched users; their results start from the first page
+        search["scope"] = scope
+        st.session_state.search_cursors = [None]
+    if search:
+        # Cursors of the pages visited so far; the last one is the current page
+        cursors = st.session_state.search_cursors
+        if search["text"]:
+            # Ranked full-text matches, filtered by date and purpose in the same query
+            purpose_filter = None if search["purpose"] == "All" else search["purpose"]
+            expenses, next_cursor = search_expenses(search["text"], purpose_filter, search["start_date"], search["end_date"], after=cursors[-1], username=scope)
+            # Only the hot database has a full-text index
+            years = [year for year in archived_years() if search["start_date"].year <= year <= search["end_date"].year]
+            if years:
+                st.info(f"Text search does not cover archived years ({', '.join(map(str, years))}); "
+                        "clear the text to find their expenses by date and purpose.")
+        elif search["purpose"] == "All":
+            expenses, next_cursor = get_expenses_by_date_range(search["start_date"], search["end_date"], after=cursors[-1], username=scope)
         else:
-            expenses = get_expenses_by_purpose_and_date_range(purpose, start_date, end_date)
-        
+            expenses, next_cursor = get_expenses_by_purpose_and_date_range(search["purpose"], search["start_date"], search["end_date"], after=cursors[-1], username=scope)
+
         if not expenses:
             st.warning("No expenses found for the given criteria.")
         else:
-            st.success(f"Found {len(expenses)} expense(s)")
-
-        for expense in expenses:
-            with st.expander(f"Expense ID: {expense[0]}, Amount: ₹{expense[2]:.2f}"):
+            import pandas as pd
+
+            st.caption(f"Page {len(cursors)}")
+            results_df = pd.DataFrame(expenses, columns=["ID", "Purchase Date", "Amount", "Purpose", "Company Name"])
+            st.dataframe(results_df, hide_index=True)
+
+            col1, col2 = st.columns(2)
+            with col1:
+                if st.button("Previous Page", disabled=len(cursors) == 1):
+                    cursors.pop()
+                    st.rerun()
+            with col2:
+                if st.button("Next Page", disabled=next_cursor is None):
+                    cursors.append(next_cursor)
+                    st.rerun()
+
+            # Only the opened expense's full record and bill image are loaded
+            expense_id = st.selectbox("Open Expense", [None] + [expense[0] for expense in expenses],
+                                      format_func=lambda i: "Select an expense" if i is None else f"Expense ID: {i}")
+            expense = get_expense(expense_id, scope) if expense_id else None
+            if expense:
                 st.write("### Expense Details")
                 st.write(f"**Date:** {expense[1]}")
                 st.write(f"**Amount:** ₹{expense[2]:.2f}")
@@ -495,8 +332,8 @@ elif page == "Search Expenses" and st.session_state.get("logged_in", False):
                 st.write(f"**Company Name:** {expense[7]}")
                 st.write(f"**Contact Details:** {expense[8]}")
                 if expense[5]:
-                    st.image(BytesIO(expense[5]), caption="Bill Image")
-                    
+                    show_bill(expense[5], key=f"search_bill_{expense[0]}", size=THUMBNAIL_PREVIEW)
+
 
 elif page == "Delete Expense" and st.session_state.get("logged_in", False) and st.session_state.get("role") == "admin":
     st.header("Delete Expense")
@@ -512,8 +349,14 @@ elif page == "Delete Expense" and st.session_state.get("logged_in", False) and s
             )
             if confirm:
                 # Call delete_expense function to delete the record
-                delete_expense(expense_id)
-                st.success(f"Expense with ID {expense_id} deleted successfully!")
+                try:
+                    delete_expense(expense_id).result(timeout=WRITE_TIMEOUT_SECONDS)
+                    st.success(f"Expense with ID {expense_id} deleted successfully!")
+                except WriteTimeout:
+                    st.error(f"The expense was not deleted within {WRITE_TIMEOUT_SECONDS:g} seconds. It may still be deleted, "
+                             "so check Search Expenses before trying again.")
+                except Exception as e:
+                    st.error(f"The expense could not be deleted: {e}")
         else:
             st.error("Please enter a valid expense ID.")
                 
@@ -522,30 +365,49 @@ elif page == "Delete Expense" and st.session_state.get("logged_in", False) and s
 elif page == "Modify Expense" and st.session_state.get("logged_in", False):
     st.header("Modify Expense")
 
-    # Select an expense to modify
-    expenses = get_expenses()
-    expense_dict = {f"{exp[3]} - ₹{exp[2]:.2f} on {exp[6]}": exp[0] for exp in expenses}
+    import pandas as pd
+
+    # Select an expense to modify; the frame is kept in memory and only
+    # fetches the expenses written since the last rerun, and only one page of
+    # it is listed
+    col1, col2 = st.columns(2)
+    purpose_filter = col1.selectbox("Purpose", ["All"] + PURPOSES, key="modify_purpose")
+    expenses = get_expense_frame(scope, None if purpose_filter == "All" else purpose_filter)
+    _, page_count = frame_page(expenses, 1)
+    # Keyed by the filter, so a new filter starts from its first page
+    page_number = col2.number_input(f"Page (of {page_count})", min_value=1, max_value=page_count, step=1,
+                                    key=f"modify_page_{scope}_{purpose_filter}")
+    page_expenses, _ = frame_page(expenses, page_number)
+    expense_dict = {f"{purpose} - ₹{amount:.2f} on {purchase_date if pd.notna(purchase_date) else None}": int(expense_id)
+                    for expense_id, purpose, amount, purchase_date in zip(page_expenses.index, page_expenses["purpose"], page_expenses["amount"], page_expenses["purchase_date"])}
     selected_expense_key = st.selectbox("Select an Expense to Modify", list(expense_dict.keys()))
 
     if selected_expense_key:
         selected_expense_id = expense_dict[selected_expense_key]
-        selected_expense = next(exp for exp in expenses if exp[0] == selected_expense_id)
+        selected_expense = frame_row(expenses, selected_expense_id)
 
         with st.form("modify_form"):
-            amount = st.number_input("Expense Amount (INR)", value=selected_expense[2], min_value=0.01, step=0.01, format="%.2f")
-            purpose = st.selectbox("Purpose of Purchase", ["Books", "Electronics", "Event", "Marketing", "Operations", "Travel", "Miscellaneous"], index=["Books", "Electronics", "Event", "Marketing", "Operations", "Travel", "Miscellaneous"].index(selected_expense[3]))
-            description = st.text_area("Description", value=selected_expense[4], max_chars=500)
-            purchase_date = st.date_input("Date of Purchase", value=pd.to_datetime(selected_expense[6]).date())
-            company_name = st.text_input("Company Name", value=selected_expense[7])
-            contact_details = st.text_input("Contact Details", value=selected_expense[8])
+            amount = st.number_input("Expense Amount (INR)", value=selected_expense["amount"], min_value=0.01, step=0.01, format="%.2f")
+            purpose = st.selectbox("Purpose of Purchase", PURPOSES, index=PURPOSES.index(selected_expense["purpose"]))
+            description = st.text_area("Description", value=selected_expense["description"], max_chars=500)
+            purchase_date = st.date_input("Date of Purchase", value=day_date(selected_expense["purchase_day"]) or date.today())
+            company_name = st.text_input("Company Name", value=selected_expense["company_name"])
+            contact_details = st.text_input("Contact Details", value=selected_expense["contact_details"])
             bill_image = st.file_uploader("Upload New Bill Image (optional)", type=["jpg", "jpeg", "png", "pdf"])
 
             update_button = st.form_submit_button("Update Expense")
 
             if update_button:
-                bill_image_bytes = bill_image.read() if bill_image else selected_expense[5]
-                update_expense(selected_expense_id, amount, purpose, description, purchase_date, bill_image_bytes, company_name, contact_details)
-                st.success("Expense updated successfully!")
+                # None keeps the bill already stored for this expense
+                bill_image_bytes = bill_image.read() if bill_image else None
+                try:
+                    update_expense(selected_expense_id, amount, purpose, description, purchase_date, bill_image_bytes, company_name, contact_details).result(timeout=WRITE_TIMEOUT_SECONDS)
+                    st.success("Expense updated successfully!")
+                except WriteTimeout:
+                    st.error(f"The expense was not updated within {WRITE_TIMEOUT_SECONDS:g} seconds. It may still be updated, "
+                             "so check Search Expenses before trying again.")
+                except Exception as e:
+                    st.error(f"The expense could not be updated: {e}")
 
 # Download Reports Page
 elif page == "Download Reports" and st.session_state.get("logged_in", False):
@@ -554,45 +416,178 @@ elif page == "Download Reports" and st.session_state.get("logged_in", False):
     with st.form("report_form"):
         start_date = st.date_input("Start Date", value=datetime(2020, 1, 1))
         end_date = st.date_input("End Date", value=datetime.now().date())
+        purpose = st.selectbox("Purpose", ["All"] + PURPOSES)
+        report_format = st.selectbox("Format", list(REPORT_FORMATS))
         download_button = st.form_submit_button("Generate Report")
 
-    # Place the download button outside the form
+    # Reports are generated on a background worker, so a large range doesn't
+    # hold up this session; the same report for unchanged data is reused
     if download_button:
-        expenses = get_expenses_by_date_range(start_date, end_date)
-        excel_file = download_expense_report_as_excel(expenses)
-        if excel_file:
-            st.download_button(
-                label="Download Expense Report as Excel",
-                data=excel_file,
-                file_name="expense_report.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-            )
-        else:
+        job = submit_report(report_format, start_date, end_date, None if purpose == "All" else purpose, scope)
+        st.session_state.report_job = job.id
+
+    # Only this fragment reruns, once a second, while the job is in progress
+    job = get_report_job(st.session_state.get("report_job"))
+    polling = job is not None and not job.finished
+
+    @st.fragment(run_every=1 if polling else None)
+    def show_report_job():
+        job = get_report_job(st.session_state.get("report_job"))
+        if job is None:
+            return
+        if polling and job.finished:
+            # Rerun the page so the fragment stops polling
+            st.rerun()
+
+        if not job.finished:
+            label = "Waiting for a free worker..." if job.status == "queued" else f"Written {job.rows_written} of {job.total_rows or 0} rows"
+            st.progress(job.progress, text=label)
+            if st.button("Cancel"):
+                cancel_report_job(job.id)
+        elif job.status == "done" and job.path:
+            try:
+                with open(job.path, "rb") as report_file:
+                    st.download_button(
+                        label=f"Download Expense Report as {job.report_format}",
+                        data=report_file.read(),
+                        file_name=job.file_name,
+                        mime=job.mime
+                    )
+            except FileNotFoundError:
+                st.warning("This report has expired, please generate it again.")
+        elif job.status == "done":
             st.warning("No expenses found for the selected date range.")
-    # Report generation logic here...
+        elif job.status == "failed":
+            st.error(f"Report generation failed: {job.error}")
+        else:
+            st.info("Report generation cancelled.")
+
+    show_report_job()
 
 elif page == "Manage Users" and st.session_state.role == "admin":
     st.header("Manage Users")
-    
-    # Fetch all users with their total expenses
-    users = get_users()
-
-    if users:
-        # Display the list of users in a table format
-        st.write("### User List")
-        for user in users:
-            username, name, role, contact_details, total_expense = user
-            st.write(f"**Username**: {username}, **Name**: {name}, **Role**: {role}, **Contact**: {contact_details}, **Total Expense**: ₹{total_expense:.2f}")
-            
-            # Delete user button
-            delete_button = st.button(f"Delete {username}")
-            if delete_button:
-                delete_user(username)
-                st.success(f"User {username} deleted successfully!")
-                break  # Refresh the page to reflect changes
-    else:
-        st.warning("No users found.")
 
+    with st.form("user_filter_form"):
+        text = st.text_input("Filter", placeholder="Part of a username or name")
+        role = st.selectbox("Role", ["All", "admin", "Developer", "Employee"])
+        filter_button = st.form_submit_button("Apply")
 
-# Initialize tables
-create_tables()
+    if filter_button or "user_cursors" not in st.session_state:
+        # Remember the filter across reruns and start from the first page
+        st.session_state.user_filter = {"text": text.strip(), "role": role}
+        st.session_state.user_cursors = [None]
+
+    # Report the last bulk action; the table below already reflects it
+    if "user_message" in st.session_state:
+        st.success(st.session_state.pop("user_message"))
+
+    # Users are read a page at a time, so the page stays quick however many
+    # accounts there are
+    user_filter = st.session_state.user_filter
+    cursors = st.session_state.user_cursors
+    users, next_cursor = get_users_page(user_filter["text"], None if user_filter["role"] == "All" else user_filter["role"], after=cursors[-1])
+
+    if not users:
+        st.warning("No users found.")
+    else:
+        import pandas as pd
+
+        st.caption(f"Page {len(cursors)}")
+        users_df = pd.DataFrame(users, columns=["Username", "Name", "Role", "Contact", "Total Expense (INR)", "Active"])
+        users_df["Active"] = users_df["Active"].astype(bool)
+        selection = st.dataframe(users_df, hide_index=True, on_select="rerun", selection_mode="multi-row", key=f"users_{len(cursors)}")
+        # The logged-in admin can't delete or deactivate their own account
+        selected = [users[row][0] for row in selection.selection.rows if users[row][0] != st.session_state.username]
+
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.button("Previous Page", disabled=len(cursors) == 1):
+                cursors.pop()
+                st.rerun()
+        with col2:
+            if st.button("Next Page", disabled=next_cursor is None):
+                cursors.append(next_cursor)
+                st.rerun()
+
+        st.write(f"**{len(selected)}** user(s) selected")
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            if st.button("Deactivate Selected", disabled=not selected):
+                set_users_active(selected, False)
+                st.session_state.user_message = f"Deactivated {len(selected)} user(s)."
+                st.rerun()
+        with col2:
+            if st.button("Activate Selected", disabled=not selected):
+                set_users_active(selected, True)
+                st.session_state.user_message = f"Activated {len(selected)} user(s)."
+                st.rerun()
+        with col3:
+            confirm_delete = st.checkbox("Also delete their expenses and bills", disabled=not selected)
+            if st.button("Delete Selected", disabled=not (selected and confirm_delete)):
+                # Users, their expenses and their unused bills go in one transaction
+                user_count, expense_count, bill_count = delete_users(selected)
+                st.session_state.user_message = f"Deleted {user_count} user(s), {expense_count} expense(s) and {bill_count} bill(s)."
+                st.rerun()
+
+elif page == "Import Expenses" and st.session_state.get("role") == "admin":
+    st.header("Import Expenses")
+    st.markdown(
+        "Upload a CSV or Excel file with **Amount**, **Purpose** and **Purchase Date** columns. "
+        "Description, Company Name, Contact Details, Username and Date are optional; "
+        "rows without a username are added under your account."
+    )
+
+    with st.form("import_form"):
+        import_file = st.file_uploader("Expense File", type=["csv", "xlsx"])
+        import_button = st.form_submit_button("Import")
+
+    if import_button and import_file is not None:
+        try:
+            with st.spinner(f"Importing in chunks of {IMPORT_CHUNK_SIZE} rows..."):
+                result = import_expenses(import_file, import_file.name, st.session_state.username)
+        except ExpenseImportError as error:
+            st.error(str(error))
+        else:
+            col1, col2, col3 = st.columns(3)
+            col1.metric("Rows Imported", result["inserted"])
+            col2.metric("Rows Rejected", result["rejected"])
+            col3.metric("Rows per Second", f"{result['rows_per_second']:.0f}")
+            st.success(f"Imported {result['inserted']} expense(s) in {result['seconds']:.1f} seconds")
+
+            if result["rejected_rows"]:
+                import pandas as pd
+
+                st.write("### Rejected Rows")
+                st.dataframe(pd.DataFrame(result["rejected_rows"], columns=["Line", "Reason"]), hide_index=True)
+
+# Timings of every SQL statement run by this server process
+elif page == "Query Profile" and st.session_state.get("role") == "admin":
+    import pandas as pd
+
+    st.header("Query Profile")
+    st.caption("Statements are grouped by fingerprint, with literals replaced by ?. "
+               "Percentiles cover the most recent samples of each statement, including fetching its rows.")
+
+    if st.button("Reset"):
+        reset_query_profile()
+
+    profile = query_profile()
+    if profile:
+        profile_df = pd.DataFrame(profile).rename(columns={
+            "statement": "Statement", "origin": "Origin", "calls": "Calls", "total_ms": "Total ms",
+            "p50_ms": "p50 ms", "p95_ms": "p95 ms", "p99_ms": "p99 ms", "max_ms": "Max ms",
+            "rows_per_call": "Rows/Call", "bytes_per_call": "Bytes/Call",
+        })
+        st.dataframe(profile_df, hide_index=True)
+    else:
+        st.info("No queries recorded yet.")
+
+    st.subheader("Slow Queries")
+    slow = slow_queries()
+    if slow:
+        slow_df = pd.DataFrame(slow)
+        slow_df["at"] = pd.to_datetime(slow_df["at"], unit="s")
+        st.dataframe(slow_df.rename(columns={"at": "At", "statement": "Statement", "ms": "ms", "rows": "Rows", "bytes": "Bytes"}),
+                     hide_index=True)
+    else:
+        st.info("No queries over the slow-query threshold.")
@@ -0,0 +1,217 @@
+import argparse
+import subprocess
+import sys
+
+from expense_store.db import get_connection, create_tables
+from expense_store.bills import prune_bills, backfill_thumbnails, recompress_bills
+from expense_store.query_plans import check_query_plans
+from expense_store.rollups import rebuild_rollups, verify_rollups, reconcile_user_totals
+from expense_store.importer import ExpenseImportError, import_expenses
+from expense_store.snapshot import export_snapshot
+from expense_store.archive import archive_expenses, archive_partitions
+from expense_store.frame import TOMBSTONE_KEEP, prune_tombstones
+
+
+# Apply pending schema migrations, e.g. moving inline bill images into the
+# bills table, then optionally compact the database file
+def migrate(args):
+    create_tables()
+    conn = get_connection()
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    print(f"Schema is at version {version}")
+
+    with conn:
+        pruned = prune_bills(conn)
+    print(f"Removed {pruned} unreferenced bill(s)")
+
+    if args.vacuum:
+        # Bill bytes cleared out of the expenses rows only leave free pages
+        # behind until the file is rebuilt
+        conn.execute("VACUUM")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        print("Database file compacted")
+
+
+# Fail if any query in the app falls back to a full table scan
+def check_plans(args):
+    problems = check_query_plans()
+    for function, sql, problem in problems:
+        print(f"{function}: {problem}")
+        if sql:
+            print(f"    {sql}")
+    if problems:
+        sys.exit(1)
+    print("All query plans use an index")
+
+
+# Check the rollup table against the raw expenses, rebuilding it on request
+def check_rollups(args):
+    create_tables()
+    conn = get_connection()
+    if args.rebuild:
+        with conn:
+            rebuild_rollups(conn)
+        print("Rollups rebuilt")
+
+    mismatches = verify_rollups(conn)
+    for username, purpose, day, total, count, rolled_total, rolled_count in mismatches:
+        print(f"{username} / {purpose} / {day}: expected {total} over {count} row(s), "
+              f"rollup has {rolled_total} over {rolled_count}")
+    if mismatches:
+        sys.exit(1)
+    print("Rollups match the expenses table")
+
+
+# Reset users.total_expense wherever it has drifted from the expenses table
+def reconcile_totals(args):
+    create_tables()
+    conn = get_connection()
+    with conn:
+        fixes = reconcile_user_totals(conn)
+    for username, stored_total, correct_total in fixes:
+        print(f"{username}: {stored_total} -> {correct_total}")
+    print(f"Reconciled {len(fixes)} user total(s)")
+
+
+# Generate thumbnails for image bills stored before thumbnails existed
+def thumbnails(args):
+    create_tables()
+    filled = backfill_thumbnails(get_connection())
+    print(f"Generated thumbnails for {filled} bill(s)")
+
+
+# Compress the bills stored before uploads were compressed, then optionally
+# compact the database file so the space is returned to the disk
+def recompress(args):
+    create_tables()
+    conn = get_connection()
+    count, size_before, size_after = recompress_bills(conn)
+    print(f"Recompressed {count} bill(s): {size_before / 1e6:.1f} MB -> {size_after / 1e6:.1f} MB, "
+          f"reclaimed {(size_before - size_after) / 1e6:.1f} MB")
+
+    if args.vacuum:
+        conn.execute("VACUUM")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        print("Database file compacted")
+
+
+# Bulk import expenses from a CSV or XLSX file
+def import_file(args):
+    create_tables()
+    try:
+        with open(args.file, "rb") as file:
+            result = import_expenses(file, args.file, args.username)
+    except ExpenseImportError as error:
+        sys.exit(str(error))
+
+    for line, reason in result["rejected_rows"]:
+        print(f"line {line}: {reason}")
+    print(f"Imported {result['inserted']} row(s), rejected {result['rejected']}, "
+          f"in {result['seconds']:.1f}s ({result['rows_per_second']:.0f} rows/s)")
+
+
+# Write or refresh the Parquet snapshot of the expenses table
+def snapshot(args):
+    create_tables()
+    result = export_snapshot(get_connection(), args.directory)
+    print(f"Wrote {result['written']} month(s) ({result['rows']} rows), reused {result['reused']}, "
+          f"removed {result['removed']}")
+
+
+# Move the expenses bought before a year into per-year archive files
+def archive(args):
+    create_tables()
+    conn = get_connection()
+    moved = archive_expenses(conn, args.before)
+    for year, rows in moved.items():
+        print(f"{year}: archived {rows} row(s)")
+    for year, file, rows in archive_partitions(conn):
+        print(f"{file}: {rows} row(s)")
+
+    if args.vacuum:
+        conn.execute("VACUUM")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        print("Database file compacted")
+
+
+# Drop the tombstones of old deletes, which only the in-memory expense frames
+# read; a frame further behind reloads in full
+def tombstones(args):
+    create_tables()
+    print(f"Removed {prune_tombstones(get_connection(), args.keep)} tombstone(s)")
+
+
+# Libraries the data layer must not pull in at import time
+HEAVY_MODULES = ["streamlit", "pandas", "plotly", "PIL", "openpyxl", "xlsxwriter", "fpdf", "pyarrow", "pytz"]
+
+
+# Time "import expense_store" in a fresh interpreter and fail if it loaded any
+# of the heavy UI or file-format libraries
+def import_time(args):
+    script = (
+        "import sys, time\n"
+        "start = time.perf_counter()\n"
+        "import expense_store\n"
+        "print(time.perf_counter() - start)\n"
+        f"print(' '.join(name for name in {HEAVY_MODULES!r} if name in sys.modules))\n"
+    )
+    output = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True).stdout
+    seconds, loaded = output.split("\n", 1)
+    print(f"import expense_store took {float(seconds) * 1000:.0f} ms")
+    if loaded.strip():
+        sys.exit(f"Heavy modules loaded at import time: {loaded.strip()}")
+    print("No heavy modules loaded")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintenance commands for the expense database")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    migrate_parser = commands.add_parser("migrate", help="apply pending schema migrations")
+    migrate_parser.add_argument("--vacuum", action="store_true", help="compact the database file afterwards")
+    migrate_parser.set_defaults(handler=migrate)
+
+    plans_parser = commands.add_parser("check-plans", help="fail if a query falls back to a full table scan")
+    plans_parser.set_defaults(handler=check_plans)
+
+    rollups_parser = commands.add_parser("rollups", help="verify the rollup table against the expenses table")
+    rollups_parser.add_argument("--rebuild", action="store_true", help="recompute the rollups before verifying")
+    rollups_parser.set_defaults(handler=check_rollups)
+
+    totals_parser = commands.add_parser("reconcile-totals", help="recompute drifted users.total_expense values")
+    totals_parser.set_defaults(handler=reconcile_totals)
+
+    thumbnails_parser = commands.add_parser("backfill-thumbnails", help="generate missing bill thumbnails")
+    thumbnails_parser.set_defaults(handler=thumbnails)
+
+    recompress_parser = commands.add_parser("recompress-bills", help="compress bills stored before uploads were compressed")
+    recompress_parser.add_argument("--vacuum", action="store_true", help="compact the database file afterwards")
+    recompress_parser.set_defaults(handler=recompress)
+
+    import_parser = commands.add_parser("import", help="bulk import expenses from a CSV or XLSX file")
+    import_parser.add_argument("file")
+    import_parser.add_argument("--username", required=True, help="owner of rows without a Username column")
+    import_parser.set_defaults(handler=import_file)
+
+    snapshot_parser = commands.add_parser("snapshot", help="write a Parquet snapshot partitioned by purchase month")
+    snapshot_parser.add_argument("directory")
+    snapshot_parser.set_defaults(handler=snapshot)
+
+    archive_parser = commands.add_parser("archive", help="move old years of expenses into per-year archive files")
+    archive_parser.add_argument("--before", type=int, required=True, help="archive expenses bought before this year")
+    archive_parser.add_argument("--vacuum", action="store_true", help="compact the database file afterwards")
+    archive_parser.set_defaults(handler=archive)
+
+    tombstones_parser = commands.add_parser("prune-tombstones", help="drop the tombstones of old deletes")
+    tombstones_parser.add_argument("--keep", type=int, default=TOMBSTONE_KEEP, help="changes whose tombstones are kept")
+    tombstones_parser.set_defaults(handler=tombstones)
+
+    import_time_parser = commands.add_parser("import-time", help="measure the data layer's import time")
+    import_time_parser.set_defaults(handler=import_time)
+
+    args = parser.parse_args()
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()